@@ -0,0 +1,317 @@
+import os
+import sys
+import time
+import random
+import datetime
+import shutil
+import tempfile
+import fire
+import h5py
+import numpy as np
+
+sys.path.append("../tools")
+from misc import get_logger
+from login import RequestBudget
+from simulator import SimClock, SimCybos, SimStockChart, SimDART, DART_TITLES
+from chart import ChartReader, chart_fields, MINUTE_COLUMNS
+from storage import LAYOUTS, layout_options, create_columns
+from screen import screen, EVENT_KINDS
+from dart import DART
+from dart_report import Danil, AllReports, REPORT_TYPES, parse_reports
+import tablerows
+from tablerows import BACKENDS
+
+
+VIEWER_CORPUS = os.path.join("res", "viewer_corpus")
+
+
+class Benchmark:
+    """
+    Benchmarks that run against in-process stand-ins instead of Cybos or DART.
+
+    $ python benchmark.py chart --codes=10
+    $ python benchmark.py storage --codes=50 --bars=20000
+    $ python benchmark.py screen --stocks=2500 --days=2500
+    $ python benchmark.py listing --days=30 --latency=0.2
+    $ python benchmark.py reports --filings=200 --latency=0.2
+    $ python benchmark.py family --filings=200 --latency=0.2
+    $ python benchmark.py parse --corpus=res/viewer_corpus
+    """
+
+    def __init__(self, codes=10, bars=100000):
+        self.logger = get_logger()
+        self.codes = ["A{:06d}".format(i * 10) for i in range(1, codes + 1)]
+        self.bars = bars
+
+    def _set_minute(self, stock_chart, stock_code):
+        stock_chart.SetInputValue(0, stock_code)
+        stock_chart.SetInputValue(1, ord('2'))
+        stock_chart.SetInputValue(4, self.bars)
+        stock_chart.SetInputValue(5, chart_fields(MINUTE_COLUMNS))
+        stock_chart.SetInputValue(6, ord("m"))
+
+    def _legacy_chart(self, stock_chart, stock_code):
+        self._set_minute(stock_chart, stock_code)
+        stock_chart.BlockRequest()
+        columns = [[] for _ in MINUTE_COLUMNS]
+        while True:
+            length = stock_chart.GetHeaderValue(3)
+            for i in range(length):
+                if 0 > stock_chart.GetDataValue(0, i):
+                    break
+                for column, values in enumerate(columns):
+                    values.append(stock_chart.GetDataValue(column, i))
+            if not stock_chart.Continue:
+                break
+            stock_chart.BlockRequest()
+        for values in columns:
+            values.reverse()
+        return len(columns[0])
+
+    def _reader_chart(self, stock_chart, stock_code, reader):
+        self._set_minute(stock_chart, stock_code)
+        reader.reset()
+        while True:
+            stock_chart.BlockRequest()
+            reader.read_block(cutoff=0)
+            if not stock_chart.Continue:
+                break
+        return len(reader)
+
+    def _report(self, name, rows, elapsed):
+        print("{:<12} rows: {:>10}  elapsed: {:8.3f}s  rows/sec: {:12.1f}".format(
+            name, rows, elapsed, rows / max(elapsed, 1e-9)))
+
+    def chart(self):
+        """rows/sec of per-cell list appends against ChartReader"""
+        stock_chart = SimStockChart()
+        start, rows = time.time(), 0
+        for stock_code in self.codes:
+            rows += self._legacy_chart(stock_chart, stock_code)
+        self._report("legacy", rows, time.time() - start)
+
+        reader = ChartReader(stock_chart, MINUTE_COLUMNS, capacity=self.bars)
+        start, rows = time.time(), 0
+        for stock_code in self.codes:
+            rows += self._reader_chart(stock_chart, stock_code, reader)
+        self._report("reader", rows, time.time() - start)
+
+    def _budget_crawl(self, wait, stock_chart, requests):
+        for _ in range(requests):
+            wait()
+            stock_chart.BlockRequest()
+
+    def budget(self, requests=1000, latency=0.05):
+        """virtual time of a crawl with fixed 15s sleeps against RequestBudget"""
+        for name in ["fixed", "budget"]:
+            clock = SimClock()
+            status = SimCybos(clock=clock)
+            stock_chart = SimStockChart(status=status, latency=latency)
+            stock_chart.SetInputValue(0, self.codes[0])
+            stock_chart.SetInputValue(5, chart_fields(MINUTE_COLUMNS))
+            if name == "fixed":
+                def wait():
+                    if status.getLimitRemainCount(1) < 2:
+                        clock.sleep(15.0)
+            else:
+                budget = RequestBudget(status, clock=clock.time, sleep=clock.sleep)
+                wait = budget.wait
+            self._budget_crawl(wait, stock_chart, requests)
+            elapsed = clock.time()
+            print("{:<12} requests: {:>8}  elapsed: {:10.1f}s  requests/sec: {:8.2f}  violations: {}".format(
+                name, requests, elapsed, requests / max(elapsed, 1e-9), status.violations))
+
+
+    def _minute_records(self):
+        stock_chart = SimStockChart()
+        reader = ChartReader(stock_chart, MINUTE_COLUMNS, capacity=self.bars)
+        records = {}
+        for stock_code in self.codes:
+            self._reader_chart(stock_chart, stock_code, reader)
+            records[stock_code] = {name: values.copy() for name, values in reader.result().items()}
+        return records
+
+    def _write_layout(self, path, records, layout, chunk_rows):
+        with h5py.File(path, "w") as fout:
+            for stock_code, record in records.items():
+                group = fout.create_group(stock_code)
+                if layout == "legacy":
+                    # python lists as the writers used to pass them, h5py widens to int64
+                    for name, values in record.items():
+                        group.create_dataset(name, data=values.tolist())
+                else:
+                    create_columns(group, record, layout_options(layout, chunk_rows))
+
+    def _read_latency(self, path, records, reads, window):
+        codes = list(records)
+        rand = random.Random(0)
+        start = time.time()
+        with h5py.File(path, "r") as fin:
+            for _ in range(reads):
+                stock_code = rand.choice(codes)
+                length = len(records[stock_code]["dates"])
+                offset = rand.randrange(max(length - window, 1))
+                for name in records[stock_code]:
+                    fin[stock_code][name][offset:offset + window]
+        return (time.time() - start) / reads
+
+    def storage(self, reads=1000, window=390, chunk_rows=None):
+        """
+        file size, write throughput and latency of random one-day reads
+        of each storage layout on synthetic minute bars
+        """
+        records = self._minute_records()
+        rows = sum(len(record["dates"]) for record in records.values())
+        workdir = tempfile.mkdtemp()
+        for layout in ["legacy"] + list(LAYOUTS):
+            path = os.path.join(workdir, layout + ".h5")
+            start = time.time()
+            self._write_layout(path, records, layout, chunk_rows)
+            elapsed = time.time() - start
+            latency = self._read_latency(path, records, reads, window)
+            print("{:<12} size: {:8.2f}MB  bytes/row: {:6.2f}  rows/sec: {:12.1f}  read: {:7.3f}ms".format(
+                layout, os.path.getsize(path) / 2 ** 20, os.path.getsize(path) / rows,
+                rows / max(elapsed, 1e-9), latency * 1000))
+            os.remove(path)
+        os.rmdir(workdir)
+
+
+    def screen(self, stocks=2500, days=2500):
+        """time of a full-market screen over synthetic daily bars"""
+        rand = np.random.RandomState(0)
+        rows = stocks * days
+        base = np.repeat(rand.randint(1000, 100000, stocks), days)
+        closes = (base * (1 + rand.randn(rows) * 0.02)).astype(np.int32)
+        columns = {
+            "dates": np.tile(np.arange(days, dtype=np.int32) + 20100000, stocks),
+            "opens": (closes * (1 + rand.randn(rows) * 0.01)).astype(np.int32),
+            "closes": closes,
+            "volumes": rand.randint(1, 100000, rows).astype(np.uint64),
+        }
+        offsets = np.arange(stocks + 1, dtype=np.int64) * days
+        codes = ["A{:06d}".format(i * 10) for i in range(stocks)]
+        start = time.time()
+        events, summary = screen(codes, offsets, columns, gap=0.05)
+        elapsed = time.time() - start
+        print("{:<12} rows: {:>10}  elapsed: {:8.3f}s  rows/sec: {:12.1f}  events: {}".format(
+            "screen", rows, elapsed, rows / max(elapsed, 1e-9), len(events["dates"])))
+
+    def listing(self, days=30, workers=4, latency=0.2, limit=None, error_rate=0.0, min_interval=0.05):
+        """
+        DART listing crawl of one worker against `workers` on a local stand-in
+        answering after `latency` seconds, optionally rate limited or failing
+        """
+        for name, count in [("sequential", 1), ("pooled", workers)]:
+            with SimDART(latency=latency, limit=limit, error_rate=error_rate) as sim:
+                dart = DART(days, workers=count, min_interval=min_interval, root=sim.root, cache="")
+                start = time.time()
+                reports = dart.get_main_page()
+                elapsed = time.time() - start
+                stats = dart.fetcher.stats()
+            print("{:<12} reports: {:>6}  requests: {:>5}  errors: {:>4}  elapsed: {:8.3f}s  "
+                  "requests/sec: {:8.2f}  p50: {:6.3f}s  p95: {:6.3f}s".format(
+                      name, len(reports), stats["requests"], stats["errors"], elapsed,
+                      stats["requests"] / max(elapsed, 1e-9), stats["p50"], stats["p95"]))
+
+    def _listing_rows(self, sim, days):
+        dart = DART(days, min_interval=0.0, root=sim.root, cache="")
+        return [dart.to_row(report) for report in dart.get_main_page()]
+
+    def reports(self, filings=200, workers=8, parsers=None, latency=0.2, min_interval=0.02):
+        """
+        documents/sec of the report pipeline against one fetch thread parsing
+        inline, on a local stand-in answering after `latency` seconds, then
+        of parsing again from a warm response cache. only the filings routed
+        to Danil are fetched and counted
+        """
+        cache = tempfile.mkdtemp()
+        with SimDART(filings=filings, latency=latency) as sim:
+            rows = self._listing_rows(sim, 1 if datetime.date.today().weekday() < 5 else 3)
+            for name, count, processes, path in [("sequential", 1, 0, ""),
+                                                 ("pipeline", workers, parsers, cache),
+                                                 ("cached", workers, parsers, cache)]:
+                report = Danil(workers=count, parsers=processes, min_interval=min_interval,
+                               root=sim.root, cache=path)
+                start = time.time()
+                results = report.crawl([dict(row) for row in rows])[report]
+                elapsed = time.time() - start
+                stats = report.fetcher.stats()
+                print("{:<12} routed: {:>6}  documents: {:>6}  requests: {:>5}  cached: {:>5}  "
+                      "elapsed: {:8.3f}s  documents/sec: {:8.2f}".format(
+                          name, sum(1 for row in rows if report.route(row)), len(results),
+                          stats["requests"], stats["hits"], elapsed, len(results) / max(elapsed, 1e-9)))
+        shutil.rmtree(cache)
+
+    def family(self, filings=200, workers=8, parsers=None, latency=0.2, min_interval=0.02):
+        """
+        time of every report type run on its own, one after the other,
+        against one pass routing the listing to all of them
+        """
+        options = dict(workers=workers, parsers=parsers, min_interval=min_interval, cache="")
+        with SimDART(filings=filings, latency=latency) as sim:
+            rows = self._listing_rows(sim, 1 if datetime.date.today().weekday() < 5 else 3)
+            total = 0.0
+            for name, report_type in REPORT_TYPES.items():
+                report = report_type(root=sim.root, **options)
+                start = time.time()
+                results = report.crawl([dict(row) for row in rows])
+                elapsed = time.time() - start
+                total += elapsed
+                print("{:<12} documents: {:>6}  requests: {:>5}  elapsed: {:8.3f}s".format(
+                    name, len(results[report]), report.fetcher.stats()["requests"], elapsed))
+            print("{:<12} {:>47.3f}s".format("separate", total))
+            report = AllReports(root=sim.root, **options)
+            start = time.time()
+            results = report.crawl([dict(row) for row in rows])
+            elapsed = time.time() - start
+            print("{:<12} documents: {:>6}  requests: {:>5}  elapsed: {:8.3f}s".format(
+                "single pass", sum(len(extracted) for extracted in results.values()),
+                report.fetcher.stats()["requests"], elapsed))
+
+    def corpus(self, path=VIEWER_CORPUS, documents=2, padding=8, date="20200228"):
+        """write `documents` viewer documents of every SimDART title to path"""
+        sim = SimDART(padding=padding)
+        os.makedirs(path, exist_ok=True)
+        written = {title: 0 for title in DART_TITLES}
+        for rcp_no in sim.rcp_nos(date):
+            title = sim.title(rcp_no)
+            if written[title] >= documents:
+                continue
+            with open(os.path.join(path, rcp_no + ".html"), "wb") as fout:
+                fout.write(sim.viewer({"rcpNo": rcp_no}).encode("utf-8"))
+            written[title] += 1
+        print("{} documents in {}".format(sum(written.values()), path))
+
+    def parse(self, corpus=VIEWER_CORPUS, repeat=3):
+        """
+        documents/sec of every report parser on each table backend over a
+        corpus of viewer documents, asserting the backends extract the same fields.
+        The malformed_*.html documents are hand-written with unclosed cells,
+        stray tags and an euc-kr charset. lxml is skipped when it is not installed
+        """
+        names = sorted(os.listdir(corpus))
+        documents = []
+        for name in names:
+            with open(os.path.join(corpus, name), "rb") as fin:
+                documents.append(fin.read())
+        reports = [report_type(cache="") for report_type in REPORT_TYPES.values()]
+        backends = [backend for backend in BACKENDS
+                    if backend != "lxml" or tablerows.lxml is not None]
+        fields = {}
+        for backend in backends:
+            start = time.time()
+            for _ in range(repeat):
+                fields[backend] = [parse_reports(reports, content, backend) for content in documents]
+            elapsed = time.time() - start
+            print("{:<12} documents: {:>6}  elapsed: {:8.3f}s  documents/sec: {:8.2f}".format(
+                backend, len(documents) * repeat, elapsed, len(documents) * repeat / max(elapsed, 1e-9)))
+        if len(backends) > 1:
+            for backend in backends[1:]:
+                differ = [name for name, got, expected in zip(names, fields[backend], fields[backends[0]])
+                          if got != expected]
+                assert not differ, "{} extracts other fields from {}".format(backend, ", ".join(differ))
+            print("identical fields: {}".format(", ".join(backends)))
+
+
+if __name__ == "__main__":
+    fire.Fire(Benchmark)
@@ -1,28 +1,63 @@
 import os
+import re
 import csv
 import sys
+import json
 from os.path import join as pjoin
 import fire
-import time
 import tqdm
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append("../tools")
 from misc import get_logger
+from web import AdaptiveThrottle, Fetcher, open_cache, HTTP_CACHE
 
 
-SATURDAY = 6
-SUNDAY = 7
+# datetime.weekday()
+SATURDAY = 5
+SUNDAY = 6
+
+# columns of res/reports.csv
+LISTING_FIELDS = ["title", "href", "company", "company_id",
+                  "year", "month", "day", "hour", "minute"]
+REPORTS = pjoin("res", "reports.csv")
+# newest listed date and rcpNo, where `update` resumes
+WATERMARK = pjoin("res", "reports.watermark.json")
+
+RCP_NO = re.compile(r"rcpNo=(\d+)")
 
-class DART:
 
-    def __init__(self, days):
+def rcp_no(href):
+    """receipt number of a filing href, None if it has none"""
+    match = RCP_NO.search(href or "")
+    return match.group(1) if match else None
+
+
+class DART:
+    """
+    :param days: calendar days of listings to fetch back from today
+    :param workers: dates fetched concurrently
+    :param min_interval: smallest spacing of requests in seconds, the throttle
+        backs off from it on slow answers, 429 and 5xx
+    :param root: DART root url, e.g. the one of simulator.SimDART
+    :param cache: directory of the response cache, empty to disable it
+    :param cache_size: MB the cache is kept under
+    :param listing_ttl: seconds a cached listing page is used for
+    """
+
+    def __init__(self, days, workers=4, min_interval=1.0, root="http://dart.fss.or.kr",
+                 cache=HTTP_CACHE, cache_size=1024, listing_ttl=3600):
         self.logger = get_logger()
-        self.root = "http://dart.fss.or.kr"
+        self.root = root
+        self.days = days
         self.from_date = datetime.now()
         self.to_date = datetime.now() - timedelta(days=days)
+        self.workers = workers
+        self.listing_ttl = listing_ttl
+        self.fetcher = Fetcher(AdaptiveThrottle(min_interval=min_interval), pool_size=workers,
+                               cache=open_cache(cache, cache_size))
 
     def _check_page_valid(self, trs):
         try:
@@ -67,56 +102,144 @@ class DART:
             self.logger.info("INVALID TUPLE")
             return {}
 
-    def get_main_page(self):
-        report_list = []
+    def _listing_dates(self, to_date=None):
+        to_date = to_date or self.to_date
+        pivot_date = self.from_date
+        while pivot_date >= to_date:
+            if pivot_date.weekday() not in (SATURDAY, SUNDAY):
+                yield pivot_date
+            pivot_date = pivot_date - timedelta(days=1)
 
+    def get_date_page(self, pivot_date, known=None):
+        """
+        every listed report of one date, pages are fetched in order
+        :param known: rcpNo already stored. the listing is newest first, so
+            no page after one holding a known rcpNo is fetched and known
+            reports are left out
+        """
+        report_list = []
         url = "{}/dsac001/mainAll.do".format(self.root)
-
-        pivot_date = self.from_date
-        while pivot_date >= self.to_date:
-            if pivot_date.weekday() == SATURDAY or pivot_date.weekday() == SUNDAY:
-                pivot_date = pivot_date - timedelta(days=1)
-                continue
-
-            self.logger.info("START GET {}".format(pivot_date.strftime("%Y.%m.%d")))
-            params = {
-                "selectDate": pivot_date.strftime("%Y%m%d"),
-                "maxResults": 500,
-                "currentPage": 1
-            }
-            while True:
-                r = requests.get(url, params=params)
-                self.logger.debug(r.url)
-                if r.status_code != 200:
-                    break
-                soup = BeautifulSoup(r.content, "html.parser")
-                trs = soup.find_all('tr')
-                if not self._check_page_valid(trs):
+        self.logger.info("START GET {}".format(pivot_date.strftime("%Y.%m.%d")))
+        params = {
+            "selectDate": pivot_date.strftime("%Y%m%d"),
+            "maxResults": 500,
+            "currentPage": 1
+        }
+        while True:
+            content = self.fetcher.get(url, params=dict(params), ttl=self.listing_ttl)
+            if content is None:
+                break
+            soup = BeautifulSoup(content, "html.parser")
+            trs = soup.find_all('tr')
+            if not self._check_page_valid(trs):
+                break
+            reports = [self._extract_tuple(tr) for tr in trs[1:]]
+            if known is not None:
+                seen = [rcp_no(report.get("href")) in known for report in reports]
+                report_list.extend(report for report, old in zip(reports, seen) if not old)
+                if any(seen):
                     break
-                for tr in trs[1:]:
-                    report_list.append(self._extract_tuple(tr))
-                params["currentPage"] = params["currentPage"] + 1
-                time.sleep(3)
-            pivot_date = pivot_date - timedelta(days=1)
+            else:
+                report_list.extend(reports)
+            params["currentPage"] = params["currentPage"] + 1
+        return report_list
+
+    def get_main_page(self, to_date=None, known=None):
+        """
+        listed reports from today back to to_date, self.to_date by default
+        :param known: rcpNo already stored, see get_date_page
+        """
+        report_list = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for reports in pool.map(lambda pivot_date: self.get_date_page(pivot_date, known),
+                                    self._listing_dates(to_date)):
+                report_list.extend(report for report in reports if report)
 
         self.logger.info("report num: {}".format(len(report_list)))
+        self.logger.info("requests: {}".format(", ".join(
+            "{}: {:.3f}".format(key, value) if isinstance(value, float) else "{}: {}".format(key, value)
+            for key, value in self.fetcher.stats().items())))
         return report_list
 
-    def save(self, results):
-        with open(pjoin('res', 'reports.csv'), 'w', encoding='utf-8', newline='') as fout:
-            wr = csv.writer(fout, delimiter='\t')
-            wr.writerow(["title", "href", "company", "company_id",
-                         "year", "month", "day", "hour", "minute"])
+    def to_row(self, result):
+        """reports.csv row of an extracted tuple"""
+        return dict(zip(LISTING_FIELDS, [
+            result["title"], result["href"], result["company_name"], result["company_id"],
+            result["datetime"].year, result["datetime"].month, result["datetime"].day,
+            result["datetime"].hour, result["datetime"].minute]))
+
+    def save(self, results, append=False):
+        exists = append and os.path.exists(REPORTS)
+        with open(REPORTS, 'a' if append else 'w', encoding='utf-8', newline='') as fout:
+            wr = csv.DictWriter(fout, fieldnames=LISTING_FIELDS, delimiter='\t')
+            if not exists:
+                wr.writeheader()
             for result in results:
-                wr.writerow([result["title"], result["href"],
-                             result["company_name"], result["company_id"],
-                             result["datetime"].year, result["datetime"].month,
-                             result["datetime"].day, result["datetime"].hour,
-                             result["datetime"].minute])
+                wr.writerow(self.to_row(result))
+
+    def load(self):
+        """rows of res/reports.csv, empty if it does not exist yet"""
+        if not os.path.exists(REPORTS):
+            return []
+        with open(REPORTS, 'r', encoding='utf-8') as fin:
+            return list(csv.DictReader(fin, delimiter='\t'))
+
+    def read_watermark(self, rows):
+        """the stored watermark, else the newest rcpNo of rows, None without either"""
+        try:
+            with open(WATERMARK) as fin:
+                return json.load(fin)
+        except (OSError, ValueError):
+            pass
+        numbers = [number for number in map(rcp_no, (row["href"] for row in rows)) if number]
+        if not numbers:
+            return None
+        return {"date": max(numbers)[:8], "rcpNo": max(numbers)}
+
+    def write_watermark(self, results, watermark=None):
+        """move the watermark to the newest of results"""
+        numbers = [number for number in (rcp_no(result["href"]) for result in results) if number]
+        if watermark is not None:
+            numbers.append(watermark["rcpNo"])
+        if not numbers:
+            return
+        newest = max(numbers)
+        with open(WATERMARK + ".part", "w") as fout:
+            json.dump({"date": newest[:8], "rcpNo": newest}, fout)
+        os.replace(WATERMARK + ".part", WATERMARK)
 
     def run(self):
         result = self.get_main_page()
         self.save(result)
+        self.write_watermark(result)
+
+    def update(self):
+        """
+        append the reports listed since the watermark to res/reports.csv.
+        dates from today back to the watermark date are fetched, each only
+        down to the first known rcpNo, and reports already stored are skipped.
+        without a watermark or listing it runs `days` back like run
+        """
+        rows = self.load()
+        watermark = self.read_watermark(rows)
+        if watermark is None:
+            self.logger.info("no watermark, fetching {} days".format(self.days))
+            return self.run()
+        known = set(number for number in (rcp_no(row["href"]) for row in rows) if number)
+        known.add(watermark["rcpNo"])
+        to_date = datetime.strptime(watermark["date"], "%Y%m%d")
+        result = []
+        for report in self.get_main_page(to_date=to_date, known=known):
+            number = rcp_no(report["href"])
+            if number is None:
+                # nothing to deduplicate by, kept like run keeps it
+                result.append(report)
+            elif number not in known:
+                known.add(number)
+                result.append(report)
+        self.logger.info("new reports since {}: {}".format(watermark["rcpNo"], len(result)))
+        self.save(result, append=True)
+        self.write_watermark(result, watermark)
 
 if __name__ == "__main__":
     fire.Fire(DART)
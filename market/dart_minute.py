@@ -8,7 +8,6 @@ import time
 import json
 import requests
 import datetime
-import win32com.client
 from os.path import join as pjoin
 
 sys.path.append("../")
@@ -16,6 +15,8 @@ from config import Config
 sys.path.append("../tools")
 from misc import get_logger
 from login import Status
+from daily import open_daily_store, request_daily, today
+from chart import ChartRequestError
 
 
 class StockCodeCache(dict):
@@ -63,10 +64,21 @@ class StockCodeCache(dict):
         super(StockCodeCache, self).__delitem__(key)
         del self.__dict__[key]
 
+DAY_COLUMNS = [
+    (0, "date", "int32"),
+    (2, "open", "int64"),
+    (12, "stocks", "int64"),
+    (13, "marketcap", "int64"),
+    (17, "foreign", "float64"),
+    (25, "turnover_ratio", "float64"),
+    (26, "transaction_ratio", "float64"),
+]
+
+
 class DartMinute(Status):
 
-    def __init__(self, conf="./config/dart_minute.json", **kwargs):
-        Status.__init__(self, conf=conf, **kwargs)
+    def __init__(self, conf="./config/dart_minute.json", verbose=False, backend="com"):
+        Status.__init__(self, conf=conf, verbose=verbose, backend=backend)
         self.model_path = "./dart_report"
         self.stockCodeCache = StockCodeCache()
         self.logger = get_logger()
@@ -84,14 +96,15 @@ class DartMinute(Status):
 
     def get_dispatch(self):
         self.assert_disconnect()
-        self.stock_chart = win32com.client.Dispatch("CpSysDib.StockChart")
+        self.stock_chart = self.dispatch("CpSysDib.StockChart")
+        self.daily = open_daily_store(self)
 
     def log_request(self):
         code = self.stock_chart.GetDibStatus()
         message = self.stock_chart.GetDibMsg1()
         if code != 0:
             self.logger.warning("code : {}, message : {}".format(code, message))
-            raise
+            raise ChartRequestError("code : {}, message : {}".format(code, message))
         if self.verbose:
             self.logger.info("code : {}, message : {}".format(code, message))
 
@@ -112,6 +125,7 @@ class DartMinute(Status):
         self.stock_chart.SetInputValue(5, [0, 1, 2, 3, 4, 5, 8])
         self.stock_chart.SetInputValue(6, ord("m"))
         self.stock_chart.SetInputValue(9, ord('1'))
+        self.budget.wait()
         self.stock_chart.BlockRequest()
         length = self.stock_chart.GetHeaderValue(3)
         minute_data = {}
@@ -131,44 +145,25 @@ class DartMinute(Status):
                 })
                 if min_date > self.stock_chart.GetDataValue(0, i):
                     break
-            if self.status.getLimitRemainCount(1) < 2:
-                time.sleep(15.0)
+            self.budget.wait()
             self.stock_chart.BlockRequest()
             self.log_request()
             length = self.stock_chart.GetHeaderValue(3)
-        self.stock_chart.SetInputValue(0, "A{}".format(stock_code))
-        self.stock_chart.SetInputValue(1, ord('2'))
-        self.stock_chart.SetInputValue(4, 100000)
-        self.stock_chart.SetInputValue(5, [0, 2, 12, 13, 17, 25, 26])
-        self.stock_chart.SetInputValue(6, ord("D"))
-        self.stock_chart.SetInputValue(9, ord('1'))
-        self.stock_chart.BlockRequest()
-        length = self.stock_chart.GetHeaderValue(3)
+        days = self.get_days("A{}".format(stock_code), min_date)
         day_data = {}
-        while self.stock_chart.Continue:
-            for i in range(length):
-                if min_date > self.stock_chart.GetDataValue(0, i):
-                    break
-                # if self.stock_chart.GetDataValue(0, i) not in pivots:
-                #     continue
-                _date = self.stock_chart.GetDataValue(0, i)
-                day_data[_date] = {
-                    "date": self.stock_chart.GetDataValue(0, i),
-                    "open": self.stock_chart.GetDataValue(1, i),
-                    "stocks": self.stock_chart.GetDataValue(2, i),
-                    "marketcap": self.stock_chart.GetDataValue(3, i),
-                    "foreign": self.stock_chart.GetDataValue(4, i),
-                    "turnover_ratio": self.stock_chart.GetDataValue(5, i),
-                    "transaction_ratio": self.stock_chart.GetDataValue(6, i),
-                }
-            if self.status.getLimitRemainCount(1) < 2:
-                time.sleep(15.0)
-            self.stock_chart.BlockRequest()
-            self.log_request()
-            length = self.stock_chart.GetHeaderValue(3)
+        for values in zip(*[days[name].tolist() for _, name, _ in DAY_COLUMNS]):
+            day_data[values[0]] = dict(zip([name for _, name, _ in DAY_COLUMNS], values))
 
         self._update_report(reports, minute_data, day_data)
 
+    def get_days(self, stock_code, min_date):
+        """daily DAY_COLUMNS from min_date, through the daily store when there is one"""
+        if self.daily is not None:
+            return self.daily.get(stock_code, DAY_COLUMNS, min_date)
+        fields = [field for field, _, _ in DAY_COLUMNS]
+        data = request_daily(self, stock_code, fields, min_date, today())
+        return {name: data[field].astype(dtype) for field, name, dtype in DAY_COLUMNS}
+
     def _update_report(self, reports, data, day_data):
         for report in reports:
             _minute_data = data.get(self._get_int_datetime(report["year"], report["month"], report["day"]), [])
@@ -230,6 +225,7 @@ class DartMinute(Status):
         self.add_report_info(report_book)
         self.save(dart_reports)
         self.stockCodeCache.save()
+        self.logger.info("request budget : {}".format(self.budget.summary()))
 
 
 def test():
@@ -3,27 +3,64 @@ import csv
 import sys
 from os.path import join as pjoin
 import fire
-import time
 import tqdm
-from bs4 import BeautifulSoup
+import asyncio
 from datetime import datetime, timedelta
-import requests
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import re
 
 sys.path.append("../tools")
 from misc import get_logger
+from web import AdaptiveThrottle, Fetcher, open_cache, HTTP_CACHE
+from tablerows import table_rows
+
+
+def parse_reports(reports, content, backend=None):
+    """
+    fields of a viewer document for each report, the tables are read once
+    :param backend: tablerows backend, None for the fastest installed
+    """
+    rows = table_rows(content, backend)
+    return [report.parse_rows(rows) for report in reports]
 
 
 class Report:
+    """
+    Documents of the filings listed in res/reports.csv, crawled by a pipeline:
+    `workers` threads fetch filing pages and viewer documents, `parsers`
+    processes parse them, and every request waits for one shared throttle.
+    Filing pages and viewer documents never change once published, they are
+    kept in the response cache for good and parsing again needs no requests.
+
+    :param workers: documents fetched concurrently
+    :param parsers: parse processes, 0 parses on the fetch threads,
+        None one per cpu
+    :param min_interval: smallest spacing of requests in seconds
+    :param root: DART root url, e.g. the one of simulator.SimDART
+    :param cache: directory of the response cache, empty to disable it
+    :param cache_size: MB the cache is kept under
+    :param backend: table extraction of tablerows, "lxml" or "bs4",
+        None for lxml when it is installed
+    """
 
-    def __init__(self, res_path="./res"):
+    def __init__(self, res_path="./res", workers=4, parsers=None, min_interval=1.0,
+                 root="http://dart.fss.or.kr", cache=HTTP_CACHE, cache_size=1024, backend=None):
         self.logger = get_logger()
-        self.root = "http://dart.fss.or.kr"
+        self.root = root
         self.res_path = res_path
         self.res_file = pjoin(res_path, "report.csv")
+        self.backend = backend
+        self.workers = workers
+        self.parsers = os.cpu_count() if parsers is None else parsers
+        self.fetcher = Fetcher(AdaptiveThrottle(min_interval=min_interval), pool_size=workers,
+                               cache=open_cache(cache, cache_size))
+
+    def __getstate__(self):
+        # parse processes only need the parser, not the session or the logger
+        return {"res_path": self.res_path, "res_file": self.res_file, "backend": self.backend}
 
     def load_reports(self):
-        with open(pjoin(self.res_path, "reports.csv"), "r") as fin:
+        with open(pjoin(self.res_path, "reports.csv"), "r", encoding="utf-8") as fin:
             reader = csv.DictReader(fin, delimiter='\t')
             header = reader
             for row in reader:
@@ -45,7 +82,7 @@ class Report:
     def check_report_valid(self, title):
         raise NotImplemented
 
-    def get_document(self, params):
+    def fetch_document(self, params):
         url = self.root + "/report/viewer.do"
         params = {
             "rcpNo": params[0],
@@ -55,16 +92,24 @@ class Report:
             "length": 0 if params[4] == 'null' else params[4],
             "dtd": params[5],
         }
-        r = requests.get(url, params=params)
-        self.logger.debug(r.url)
-        if r.status_code != 200:
-            self.logger.warning("GET error: {}".format(r.url))
+        return self.fetcher.get(url, params=params)
+
+    def get_document(self, params):
+        content = self.fetch_document(params)
+        if content is None:
             return None
-        data = self.parse_document(r.content)
+        data = self.parse_document(content)
 
         return data
 
     def parse_document(self, content):
+        return self.parse_rows(table_rows(content, self.backend))
+
+    def parse_rows(self, rows):
+        """
+        :param rows: cell texts of every table row, see tablerows.table_rows
+        :return: {field: value} of the report
+        """
         raise NotImplemented
 
     def _clean_data(self, data):
@@ -83,18 +128,22 @@ class Report:
                 return params
         return []
 
-    def get_report(self, href):
-        url = self.root + href
-        r = requests.get(url)
-        self.logger.debug(r.url)
-        if r.status_code != 200:
-            self.logger.warning("GET error: {}".format(r.url))
+    def fetch_report(self, href):
+        """viewer document of a filing page, None if either page failed"""
+        content = self.fetcher.get(self.root + href)
+        if content is None:
             return None
-        params = self._get_report_document(r.text)
+        params = self._get_report_document(content.decode("utf-8", "replace"))
         if not params:
             return None
 
-        return self.get_document(params)
+        return self.fetch_document(params)
+
+    def get_report(self, href):
+        content = self.fetch_report(href)
+        if content is None:
+            return None
+        return self.parse_document(content)
 
     def save(self, results):
         if not isinstance(results, list) or len(results) == 0:
@@ -109,25 +158,72 @@ class Report:
             for result in results:
                 writer.writerow(result)
 
+    def targets(self):
+        """report types extracted by this run"""
+        return [self]
+
+    def route(self, row):
+        """report types a listed row is a filing of, empty to skip its document"""
+        if not self.check_report_datetime(row):
+            return []
+        return [report for report in self.targets() if report.check_report_valid(row.get("title"))]
+
+    async def _crawl(self, loop, routed, fetch_pool, parse_pool, progress):
+
+        async def extract(row, reports):
+            content = await loop.run_in_executor(fetch_pool, self.fetch_report, row.get("href"))
+            extracted = []
+            if content is not None:
+                parsed = await loop.run_in_executor(parse_pool, parse_reports, reports,
+                                                    content, self.backend)
+                extracted = [(report, dict(row, **data)) for report, data in zip(reports, parsed)]
+            progress.update(1)
+            return extracted
+
+        return await asyncio.gather(*[extract(row, reports) for row, reports in routed])
+
+    def crawl(self, rows):
+        """
+        fetch the document of each row once and parse it for every report
+        type the row is routed to, fetches overlap the parsing. rows routed
+        to no report type are skipped before their document is fetched
+        :return: {report: rows updated with its parsed fields} in listing order,
+            rows whose document could not be fetched are dropped
+        """
+        routed = [(row, reports) for row, reports in ((row, self.route(row)) for row in rows) if reports]
+        fetch_pool = ThreadPoolExecutor(max_workers=self.workers)
+        parse_pool = ProcessPoolExecutor(max_workers=self.parsers) if self.parsers else fetch_pool
+        loop = asyncio.new_event_loop()
+        try:
+            with tqdm.tqdm(total=len(routed)) as progress:
+                extracted = loop.run_until_complete(
+                    self._crawl(loop, routed, fetch_pool, parse_pool, progress))
+        finally:
+            loop.close()
+            fetch_pool.shutdown()
+            parse_pool.shutdown()
+        results = {report: [] for report in self.targets()}
+        for report, row in (pair for pairs in extracted for pair in pairs):
+            results[report].append(row)
+        return results
+
     def run(self):
-        results = []
-        print("START CRAWLING TO {}".format(self.res_file))
-        for row in tqdm.tqdm(self.load_reports()):
-            if not self.check_report_valid(row.get("title")):
-                continue
-            if not self.check_report_datetime(row):
-                continue
-            data = self.get_report(row.get("href"))
-            row.update(data)
-            results.append(row)
-            time.sleep(2)
-        self.save(results)
+        for report in self.targets():
+            print("START CRAWLING TO {}".format(report.res_file))
+        rows = list(self.load_reports())
+        results = self.crawl(rows)
+        stats = self.fetcher.stats()
+        self.logger.info("listed: {}, requests: {}, cached: {}".format(
+            len(rows), stats["requests"], stats["hits"]))
+        for report, extracted in results.items():
+            self.logger.info("{}: {}".format(type(report).__name__, len(extracted)))
+            report.save(extracted)
 
 
 class Danil(Report):
 
-    def __init__(self):
-        Report.__init__(self)
+    def __init__(self, **kwargs):
+        Report.__init__(self, **kwargs)
         self.res_file = pjoin(self.res_path, "danil.csv")
 
     def check_report_valid(self, title):
@@ -135,22 +231,17 @@ class Danil(Report):
             return False
         return "단일판매" in title
 
-    def parse_document(self, content):
-        soup = BeautifulSoup(content, "html.parser")
-        trs = soup.find_all('tr')
+    def parse_rows(self, rows):
         data = {
             "total_payment": 0,
             "recent_profit": 0,
             "profit_ratio": 0.0,
             "big_deal": "",
         }
-        for tr in trs:
-            tds = tr.find_all("td")
-
+        for tds in rows:
             key = None
             value = None
-            for td in tds:
-                row = td.text.strip() or ""
+            for row in tds:
                 if "계약금액" in row:
                     key = "total_payment"
                 elif "최근" in row and "매출액" in row:
@@ -173,8 +264,8 @@ class Danil(Report):
 
 class Usang(Report):
 
-    def __init__(self):
-        Report.__init__(self)
+    def __init__(self, **kwargs):
+        Report.__init__(self, **kwargs)
         self.res_file = pjoin(self.res_path, "usang.csv")
 
     def check_report_valid(self, title):
@@ -182,20 +273,16 @@ class Usang(Report):
             return False
         return "유상증자결정" in title
 
-    def parse_document(self, content):
-        soup = BeautifulSoup(content, "html.parser")
-        trs = soup.find_all('tr')
+    def parse_rows(self, rows):
         data = {
             "facility_fund": 0,
             "operation_fund": 0,
             "acquisition_fund": 0,
             "guitar_fund": 0,
         }
-        for tr in trs:
-            tds = tr.find_all("td")
+        for tds in rows:
             key, value = None, None
-            for td in tds:
-                row = td.text.strip() or ""
+            for row in tds:
                 if "시설자금" in row:
                     key = "facility_fund"
                 elif "운영자금" in row:
@@ -217,8 +304,8 @@ class Usang(Report):
 
 class TreasuryStock(Report):
 
-    def __init__(self):
-        Report.__init__(self)
+    def __init__(self, **kwargs):
+        Report.__init__(self, **kwargs)
         self.res_file = pjoin(self.res_path, "treasury.csv")
 
     def check_report_valid(self, title):
@@ -226,18 +313,14 @@ class TreasuryStock(Report):
             return False
         return "자기주식취득결정" in title
 
-    def parse_document(self, content):
-        soup = BeautifulSoup(content, "html.parser")
-        trs = soup.find_all('tr')
+    def parse_rows(self, rows):
         data = {
             "buy_stock": 0,
             "buy_amount": 0,
         }
-        for tr in trs:
-            tds = tr.find_all("td")
+        for tds in rows:
             key, value = None, None
-            for td in tds:
-                row = td.text.strip() or ""
+            for row in tds:
                 if "취득예정주식" in row:
                     key = "buy_stock"
                 elif "취득예정금액" in row:
@@ -273,8 +356,8 @@ class CB(Report):
     stock_ratio: 전환에 따라 발행할 주식 - 주식총수대비(%)
     """
 
-    def __init__(self):
-        Report.__init__(self)
+    def __init__(self, **kwargs):
+        Report.__init__(self, **kwargs)
         self.res_file = pjoin(self.res_path, "cb.csv")
 
     def check_report_valid(self, title):
@@ -294,9 +377,7 @@ class CB(Report):
                 return token.replace(",", "")
         return ""
 
-    def parse_document(self, content):
-        soup = BeautifulSoup(content, "html.parser")
-        trs = soup.find_all('tr')
+    def parse_rows(self, rows):
         data = {
             "cb_amount": 0,
             "facility_fund": 0,
@@ -309,9 +390,8 @@ class CB(Report):
             "amortization_method": "",
             "stock_ratio": 0.0,
         }
-        for tr in trs:
-            tds = tr.find_all("td")
-            tds_text = [td.text.strip() for td in tds if td.text.strip()]
+        for tds in rows:
+            tds_text = [text for text in tds if text]
             if self._list_contain(tds_text, "사채의 권면총액"):
                 data["cb_amount"] = self._get_numeric_value(tds_text)
             elif self._list_contain(tds_text, "시설자금"):
@@ -345,10 +425,34 @@ class CB(Report):
         return data
 
 
+REPORT_TYPES = {
+    "Danil": Danil,
+    "Usang": Usang,
+    "Treasury": TreasuryStock,
+    "CB": CB,
+}
+
+
+class AllReports(Report):
+    """
+    Several report types in one pass over the listing.
+
+    Each row is routed to every type whose check_report_valid accepts its
+    title, its document is fetched once and parsed by each of them, and each
+    type saves to its own file as if it ran alone.
+    :param types: names in REPORT_TYPES, e.g. "Danil,CB", all of them by default
+    """
+
+    def __init__(self, types=None, **kwargs):
+        Report.__init__(self, **kwargs)
+        if isinstance(types, str):
+            types = types.split(",")
+        self.types = [REPORT_TYPES[name](res_path=self.res_path, cache="")
+                      for name in types or REPORT_TYPES]
+
+    def targets(self):
+        return self.types
+
+
 if __name__ == "__main__":
-    fire.Fire({
-        "Danil": Danil,
-        "Usang": Usang,
-        "Treasury": TreasuryStock,
-        "CB": CB,
-    })
+    fire.Fire(dict(REPORT_TYPES, All=AllReports))
@@ -3,34 +3,45 @@ import sys
 sys.path.append("../tools")
 from os.path import join as pjoin
 import fire
+import json
 import tqdm
 import h5py
-import win32com.client
+import numpy as np
 from misc import get_logger
 from login import Status
+from chart import ChartRequestError, chart_fields, MINUTE_COLUMNS
+from universe import open_universe
+from planner import PivotPlanner
+from ranking import CrossSection, RANK_FIELDS
+from daily import open_daily_store
+from storage import ColumnStream, open_layout, layout_options
+from crawl import crawl_codes
+from table import pack_table
+from store import MinuteStore
+from shard import shard_of, shard_name, write_manifest, merge_shards
 import time
 
 
 class NinetoTen(Status):
 
+    def __init__(self, conf="./config/ninetoten.json", verbose=False, backend="com"):
+        Status.__init__(self, conf=conf, verbose=verbose, backend=backend)
+        self.planner = PivotPlanner(window=self.opt.window or (901, 1130),
+                                    max_gap=self.opt.max_gap or 3)
+        self.requests = {}
+        self.layout = open_layout(self)
+
     def get_dispatch(self):
         self.assert_disconnect()
-        self.stock_chart = win32com.client.Dispatch("CpSysDib.StockChart")
-        self.stockcode = win32com.client.Dispatch("CpUtil.CpCodeMgr")
+        self.stock_chart = self.dispatch("CpSysDib.StockChart")
+        self.stockcode = self.dispatch("CpUtil.CpCodeMgr")
+        self.universe = open_universe(self, self.stockcode)
+        self.daily = open_daily_store(self)
 
     def get_stockcode(self):
-        codeList = self.stockcode.GetStockListByMarket(1)
-        codeList2 = self.stockcode.GetStockListByMarket(2)
-        stockcodes = []
-        self.stocknames = {}
-        for i, code in enumerate(codeList + codeList2):
-            section = self.stockcode.GetStockSectionKind(code)
-            if section != 1:
-                # not corporation such as ETF, futures, ...
-                continue
-            name = self.stockcode.CodeToName(code)
-            stockcodes.append(code)
-            self.stocknames[code] = name
+        # corporations only, not ETF, futures, ...
+        stockcodes = self.universe.codes(markets=(1, 2), sections=(1,))
+        self.stocknames = self.universe.names(stockcodes)
         self.logger.info("Get stock list : {}".format(len(stockcodes)))
         return stockcodes
 
@@ -39,52 +50,72 @@ class NinetoTen(Status):
         message = self.stock_chart.GetDibMsg1()
         if code != 0:
             self.logger.warning("code : {}, message : {}".format(code, message))
-            raise
+            raise ChartRequestError("code : {}, message : {}".format(code, message))
         if self.verbose:
             self.logger.info("code : {}, message : {}".format(code, message))
 
-    def get_minute_data(self, stockcode, pivots):
+    def _read_pivot_block(self, pivot_set):
+        """
+        rows of the current block on pivot dates inside the planner window,
+        in chronological order
+        only dates are read for every row, other fields only for kept rows
+        """
+        length = self.stock_chart.GetHeaderValue(3)
+        get = self.stock_chart.GetDataValue
+        dates = [get(0, i) for i in range(length)]
+        rows = [i for i in range(length) if dates[i] in pivot_set]
+        minutes = {i: get(1, i) for i in rows}
+        rows = [i for i in reversed(rows) if self.planner.in_window(minutes[i])]
+        block = {"dates": [dates[i] for i in rows], "minutes": [minutes[i] for i in rows]}
+        for column, (_, key, _) in enumerate(MINUTE_COLUMNS[2:], 2):
+            block[key] = [get(column, i) for i in rows]
+        return {key: np.asarray(block[key], dtype=dtype) for _, key, dtype in MINUTE_COLUMNS}
+
+    def get_minute_data(self, stockcode, pivots, ranges=None, stream=None):
         """
         get minute data of target stock and datetimes
         :param stockcode: kospi, kosdaq stockcode which startswith "A"
         :param pivots: list of target datetimes
+        :param ranges: period ranges from the planner, planned from pivots if omitted
+        :param stream: ColumnStream each block is written to as it arrives
         :return: dict of dates, minutes, opens, highs, lows, closes, volumes
+            in chronological order, empty when streamed
         """
         if not isinstance(pivots, list) or not pivots:
             return {}
-        self.stock_chart.SetInputValue(0, stockcode)
-        self.stock_chart.SetInputValue(1, ord('2'))
-        self.stock_chart.SetInputValue(4, 100000)
-        self.stock_chart.SetInputValue(5, [0, 1, 2, 3, 4, 5, 8])
-        self.stock_chart.SetInputValue(6, ord("m"))
-        self.stock_chart.SetInputValue(9, ord('1'))
-        self.stock_chart.BlockRequest()
-
-        candle = {}
-        length = self.stock_chart.GetHeaderValue(3)
-        while self.stock_chart.Continue:
-            for i in range(length):
-                if self.stock_chart.GetDataValue(0, i) not in pivots:
-                    continue
-                minute = self.stock_chart.GetDataValue(1, i)
-                if 901 <= minute and minute < 1130:
-                    candle.setdefault("dates", []).append(self.stock_chart.GetDataValue(0, i))
-                    candle.setdefault("minutes", []).append(self.stock_chart.GetDataValue(1, i))
-                    candle.setdefault("opens", []).append(self.stock_chart.GetDataValue(2, i))
-                    candle.setdefault("highs", []).append(self.stock_chart.GetDataValue(3, i))
-                    candle.setdefault("lows", []).append(self.stock_chart.GetDataValue(4, i))
-                    candle.setdefault("closes", []).append(self.stock_chart.GetDataValue(5, i))
-                    candle.setdefault("volumes", []).append(self.stock_chart.GetDataValue(6, i))
-            if pivots[0] > self.stock_chart.GetDataValue(0, 0):
-                break
-            if self.opt.startdate > self.stock_chart.GetDataValue(0, 0):
-                break
-            if self.status.getLimitRemainCount(1) < 2:
-                time.sleep(15.0)
-            self.stock_chart.BlockRequest()
-            self.log_request()
-            length = self.stock_chart.GetHeaderValue(3)
-        return candle
+        if ranges is None:
+            ranges = self.planner.ranges(pivots, self.opt.startdate)
+        pivot_set = set(pivots)
+        blocks = []
+        requests = 0
+        for start, end in ranges:
+            self.stock_chart.SetInputValue(0, stockcode)
+            self.stock_chart.SetInputValue(1, ord('1'))
+            self.stock_chart.SetInputValue(2, end)
+            self.stock_chart.SetInputValue(3, start)
+            self.stock_chart.SetInputValue(4, 100000)
+            self.stock_chart.SetInputValue(5, chart_fields(MINUTE_COLUMNS))
+            self.stock_chart.SetInputValue(6, ord("m"))
+            self.stock_chart.SetInputValue(9, ord('1'))
+            while True:
+                self.budget.wait()
+                self.stock_chart.BlockRequest()
+                self.log_request()
+                requests += 1
+                block = self._read_pivot_block(pivot_set)
+                if stream is not None:
+                    stream.write(block)
+                elif len(block["dates"]):
+                    blocks.append(block)
+                if not self.stock_chart.Continue:
+                    break
+        self.requests[stockcode] = requests
+        self.logger.debug("{} ranges : {}, block requests : {}".format(stockcode, len(ranges), requests))
+        if not blocks:
+            return {}
+        # blocks arrive newest first
+        return {key: np.concatenate([block[key] for block in reversed(blocks)])
+                for _, key, _ in MINUTE_COLUMNS}
 
     def get_tick_data(self, stockcode, pivots):
         """deprecated"""
@@ -96,6 +127,7 @@ class NinetoTen(Status):
         self.stock_chart.SetInputValue(5, [0, 1, 2, 8])
         self.stock_chart.SetInputValue(6, ord("T"))
         self.stock_chart.SetInputValue(9, ord('1'))
+        self.budget.wait()
         self.stock_chart.BlockRequest()
         length = self.stock_chart.GetHeaderValue(3)
         dates, minutes, prices, volumes = [], [], [], []
@@ -111,22 +143,29 @@ class NinetoTen(Status):
                     volumes.append(self.stock_chart.GetDataValue(3, i))
             if pivots[0] > self.stock_chart.GetDataValue(0, i):
                 break
-            if self.status.getLimitRemainCount(1) < 2:
-                time.sleep(15.0)
+            self.budget.wait()
             self.stock_chart.BlockRequest()
             self.log_request()
             length = self.stock_chart.GetHeaderValue(3)
         return dates, minutes, prices, volumes
 
-    def get_volume(self, stockcode, time_mode="D"):
+    def get_volume(self, stockcode, time_mode="D", field=8):
+        """
+        :param field: StockChart field read as the volume column, 8 for volume
+        """
         assert time_mode in ["D", "W", "M", "m", "T"], "invalid time mode"
+        if time_mode == "D" and self.daily is not None:
+            record = self.daily.get(stockcode, [(0, "dates", "int32"), (field, "volumes", "float64")],
+                                    self.opt.startdate)
+            return record["dates"], record["volumes"]
 
         self.stock_chart.SetInputValue(0, stockcode)
         self.stock_chart.SetInputValue(1, ord('2'))
         self.stock_chart.SetInputValue(4, 1000)
-        self.stock_chart.SetInputValue(5, [0, 8])
+        self.stock_chart.SetInputValue(5, [0, field])
         self.stock_chart.SetInputValue(6, ord(time_mode))
         self.stock_chart.SetInputValue(9, ord('1'))
+        self.budget.wait()
         self.stock_chart.BlockRequest()
         length = self.stock_chart.GetHeaderValue(3)
         dates, volumes = [], []
@@ -145,8 +184,7 @@ class NinetoTen(Status):
                 volumes.append(self.stock_chart.GetDataValue(1, i))
             if self.opt.startdate > self.stock_chart.GetDataValue(0, 0):
                 break
-            if self.status.getLimitRemainCount(1) < 2:
-                time.sleep(15.0)
+            self.budget.wait()
             self.stock_chart.BlockRequest()
             self.log_request()
             length = self.stock_chart.GetHeaderValue(3)
@@ -154,51 +192,64 @@ class NinetoTen(Status):
         assert len(dates) == len(volumes)
         return dates, volumes
 
+    def get_cross_section(self, rank_key="volume"):
+        """
+        daily series of every stock as a date x stock matrix
+        :param rank_key: one of RANK_FIELDS, volume, value or turnover
+        """
+        stockcodes = self.get_stockcode()
+        series = {}
+        for stockcode in tqdm.tqdm(stockcodes):
+            series[stockcode] = self.get_volume(stockcode, field=RANK_FIELDS[rank_key])
+        section = CrossSection(series)
+        if len(section.dates):
+            self.logger.info("get dates from {} to {}".format(section.dates[0], section.dates[-1]))
+        return section
+
     def get_high_volume(self):
         """
         get high volume stocks between opt.fromdate to opt.todate
+        ranked by opt.rank_key, volume by default
         :return: {
             "20200101": [code1, code2, ...],
             ...
         }
         """
-        stockcodes = self.get_stockcode()
-        stockdata, dateset = dict(), set()
-        for stockcode in tqdm.tqdm(stockcodes):
-            dates, volumes = self.get_volume(stockcode)
-            stockdata[stockcode] = {int(date): volume for date, volume in zip(dates, volumes)}
-            dateset |= set(dates)
-        self.logger.info("get dates from {} to {}".format(min(dateset), max(dateset)))
-
+        section = self.get_cross_section(self.opt.rank_key or "volume")
+        dates, top = section.top_k(self.opt.top_volume, self.opt.fromdate, self.opt.todate)
         high_volume = {}
-        for date in dateset:
-            if date < self.opt.fromdate or self.opt.todate < date:
-                continue
-            price = [(stockcode, series[date]) for stockcode, series in stockdata.items() if date in series]
-            price = sorted(price, key=lambda x: x[1], reverse=True)
-            high_volume[date] = [stockcode for stockcode, p in price[:self.opt.top_volume]]
-
+        for date, indices in zip(dates, top):
+            high_volume[int(date)] = [section.codes[index] for index in indices if index >= 0]
         return high_volume
 
-    def save(self, stock_map):
-        stockcodes = []
+    def save(self, stock_map, resume=False, shard=None, shards=1):
+        """
+        :param stock_map: {stockcode: sorted pivot dates}
+        :param resume: skip stocks completed by an interrupted run
+        :param shard: write a shard file and manifest instead of ninetoten.h5
+        """
+        name = "ninetoten" if shard is None else shard_name("ninetoten", shard, shards)
         self.logger.info("Extract minute data : {} stocks".format(len(stock_map.keys())))
-        with h5py.File(pjoin(self.opt.export_to, "ninetoten.h5"), "w") as fout:
-            for stockcode, datelist in tqdm.tqdm(stock_map.items()):
-                candle = self.get_minute_data(stockcode, datelist)
-                if not candle:
-                    continue
-                stockcodes.append(stockcode)
-                stockgroup = fout.create_group(stockcode)
-                stockgroup.create_dataset("dates", data=candle["dates"])
-                stockgroup.create_dataset("minutes", data=candle["minutes"])
-                stockgroup.create_dataset("opens", data=candle["opens"])
-                stockgroup.create_dataset("highs", data=candle["highs"])
-                stockgroup.create_dataset("lows", data=candle["lows"])
-                stockgroup.create_dataset("closes", data=candle["closes"])
-                stockgroup.create_dataset("volumes", data=candle["volumes"])
-        with open(pjoin(self.opt.export_to, "ninetoten.keys"), "w") as fout:
-            fout.write("\n".join(stockcodes))
+        plans = self.planner.plan(stock_map, self.opt.startdate)
+        self.logger.info("Planned {} ranges".format(sum(len(ranges) for ranges in plans.values())))
+
+        def save_stock(fout, stockcode):
+            if stockcode in fout:
+                del fout[stockcode]
+            stream = ColumnStream(fout.create_group(stockcode), MINUTE_COLUMNS, self.layout)
+            self.get_minute_data(stockcode, stock_map[stockcode], plans.get(stockcode, []), stream)
+            if not stream.finish():
+                del fout[stockcode]
+
+        written = set(crawl_codes(self.opt.export_to, name, list(stock_map), save_stock, resume=resume))
+        stockcodes = [stockcode for stockcode in stock_map if stockcode in written]
+        if shard is None:
+            with open(pjoin(self.opt.export_to, "ninetoten.keys"), "w") as fout:
+                fout.write("\n".join(stockcodes))
+        else:
+            write_manifest(self.opt.export_to, "ninetoten", shard, shards, stockcodes, stockcodes)
+        self.logger.info("block requests : {} over {} stocks".format(
+            sum(self.requests.values()), len(self.requests)))
 
     def test_save(self):
         with h5py.File(pjoin(self.opt.export_to, "ninetoten.h5"), "r") as fin:
@@ -206,6 +257,23 @@ class NinetoTen(Status):
                 print(k)
                 print(fin[k]["dates"])
 
+    def pack(self, layout="contiguous"):
+        """
+        pack ninetoten.h5 into ninetoten.table.h5, a single column table indexed by code
+        :param layout: storage layout of the table, contiguous columns are memory-mapped by MinuteStore
+        """
+        count = pack_table(pjoin(self.opt.export_to, "ninetoten.h5"),
+                           pjoin(self.opt.export_to, "ninetoten.table.h5"),
+                           layout_options(layout, self.opt.get("chunk_rows")))
+        self.logger.info("packed {} stocks".format(count))
+
+    def test_table(self):
+        with MinuteStore(pjoin(self.opt.export_to, "ninetoten.table.h5")) as fin:
+            dates, offsets = fin.column("dates")
+            for i, k in enumerate(fin.keys()):
+                print(k)
+                print(dates[offsets[i]:offsets[i + 1]])
+
     def test(self):
         self.get_dispatch()
         self.get_stockcode()
@@ -220,15 +288,60 @@ class NinetoTen(Status):
         dates, volumes = self.get_volume("A093230")
         print(dates[0], volumes[0])
 
-    def run(self):
-        self.get_dispatch()
+    def _plan_path(self):
+        return pjoin(self.opt.export_to, "ninetoten.plan.json")
+
+    def make_plan(self):
         volume = self.get_high_volume()
         stock_map = {}
         for date, stockcodes in volume.items():
             for stockcode in stockcodes:
                 stock_map.setdefault(stockcode, []).append(date)
         stock_map = {k: sorted(v) for k, v in stock_map.items()}
-        self.save(stock_map)
+        with open(self._plan_path(), "w") as fout:
+            json.dump(stock_map, fout)
+        return stock_map
+
+    def plan(self):
+        """
+        rank stocks once and write ninetoten.plan.json for sharded workers
+        """
+        self.get_dispatch()
+        self.make_plan()
+        self.logger.info("request budget : {}".format(self.budget.summary()))
+
+    def run(self, resume=False, shard=None, shards=1):
+        """
+        :param resume: reuse the stock map and skip stocks completed by an interrupted run
+        :param shard: index of this worker when stocks are split into `shards`,
+            needs the stock map written by plan and writes a shard file for merge
+        """
+        self.get_dispatch()
+        plan_path = self._plan_path()
+        if (resume or shard is not None) and os.path.exists(plan_path):
+            with open(plan_path, "r") as fin:
+                stock_map = json.load(fin)
+        elif shard is not None:
+            raise ValueError("{} not found, run plan before sharded workers".format(plan_path))
+        else:
+            stock_map = self.make_plan()
+        if shard is None:
+            self.save(stock_map, resume=resume)
+            os.remove(plan_path)
+        else:
+            stock_map = {stockcode: dates for stockcode, dates in stock_map.items()
+                         if shard_of(stockcode, shards) == shard}
+            self.save(stock_map, resume=resume, shard=shard, shards=shards)
+        self.logger.info("request budget : {}".format(self.budget.summary()))
+
+    def merge(self, shards):
+        """
+        merge shard files of `run --shard=i --shards=N` workers into ninetoten.h5
+        """
+        stockcodes = merge_shards(self.opt.export_to, "ninetoten", shards)
+        if os.path.exists(self._plan_path()):
+            os.remove(self._plan_path())
+        self.logger.info("merged {} stocks from {} shards".format(len(stockcodes), shards))
 
 
 if __name__ == "__main__":
@@ -1,4 +1 @@
-python dart_report.py Danil run
-python dart_report.py CB run
-python dart_report.py Usang run
-python dart_report.py Treasury run
+python dart_report.py All run
@@ -4,7 +4,6 @@ import time
 import json
 import requests
 import datetime
-import win32com.client
 from os.path import join as pjoin
 
 sys.path.append("../")
@@ -12,6 +11,7 @@ from config import Config
 sys.path.append("../tools")
 from misc import get_logger
 from login import Status
+from universe import Universe, diff_meta
 
 
 class StockMeta(Status):
@@ -47,28 +47,18 @@ class StockMeta(Status):
 
     def get_dispatch(self):
         self.assert_disconnect()
-        self.code = win32com.client.Dispatch("CpUtil.CpCodeMgr")
-
-    def save(self, info):
-        with open(pjoin(self.res_path, "stock_meta.json"), 'w', newline='') as fout:
-            json.dump(info, fout)
+        self.code = self.dispatch("CpUtil.CpCodeMgr")
 
     def run(self):
+        """
+        refresh stock_meta.json against the stored snapshot, changes are
+        appended to stock_meta_history.jsonl
+        """
         self.get_dispatch()
-        kospi = self.code.GetStockListByMarket(1)
-        kosdaq = self.code.GetStockListByMarket(2)
-        self.logger.info("get {} stocks".format(len(kospi) + len(kosdaq)))
-
-        info = {}
-        for stock in kospi + kosdaq:
-            info[stock] = dict(
-                name=self.code.CodeToName(stock),
-                mememin=self.code.GetStockMemeMin(stock),
-                marketkind=self.code.GetStockMarketKind(stock),
-                sectionkind=self.code.GetStockSectionKind(stock),
-                listeddate=self.code.GetStockListedDate(stock),
-            )
-        self.save(info)
+        universe = Universe(lambda previous, fields: diff_meta(self.code, previous, fields=fields),
+                            path=pjoin(self.res_path, "stock_meta.json"), ttl=-1, fields_ttl=-1)
+        info = universe.load()
+        self.logger.info("get {} stocks".format(len(info)))
 
 if __name__ == "__main__":
     sm = StockMeta()
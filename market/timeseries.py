@@ -5,87 +5,133 @@ from os.path import join as pjoin
 import fire
 import tqdm
 import h5py
-import win32com.client
 from misc import get_logger
 from login import Status
+from chart import ChartRequestError, ChartReader, chart_fields, field_columns
+from storage import ColumnStream, open_layout, staging_path, commit_staging
+from crawl import crawl_codes
+from universe import open_universe
 import time
 
 
 class TImeSeries(Status):
+    """
+    $ python timeseries.py --conf config/timeseries.json run
+    $ python timeseries.py --conf config/timeseries.json batch --codes=A005930,A000660
+    """
+
+    def __init__(self, conf="./config/timeseries.json", verbose=False, backend="com"):
+        Status.__init__(self, conf=conf, verbose=verbose, backend=backend)
+        self.columns = field_columns(self.opt.format)
+        self.layout = open_layout(self)
+        self.stock_chart = None
+        self.reader = None
 
     def get_dispatch(self):
         self.assert_disconnect()
-        self.stock_chart = win32com.client.Dispatch("CpSysDib.StockChart")
+        self.stock_chart = self.dispatch("CpSysDib.StockChart")
+        self.reader = ChartReader(self.stock_chart, self.columns, capacity=4096)
 
-    def _set(self):
-        feature = sorted(list(map(int,list(self.opt.format.keys()))))
-        self.idmap = {key: num for num, key in enumerate(feature)}
-        self.stock_chart.SetInputValue(0, self.opt.stockcode)
+    def _set(self, stockcode):
+        self.stock_chart.SetInputValue(0, stockcode)
         self.stock_chart.SetInputValue(1, ord('2'))
         self.stock_chart.SetInputValue(2, self.opt.startdate)
         self.stock_chart.SetInputValue(4, self.opt.datalen)
-        self.stock_chart.SetInputValue(5, feature)
+        self.stock_chart.SetInputValue(5, chart_fields(self.columns))
         self.stock_chart.SetInputValue(6, ord(self.opt.datatype))
         self.stock_chart.SetInputValue(9, ord('1'))
 
-    def _get_tuple(self, i):
-        res = {value : self.stock_chart.GetDataValue(self.idmap[int(key)], i)
-                for key, value in self.opt.format.items()}
-        return res
-
     def log_request(self):
         code = self.stock_chart.GetDibStatus()
         message = self.stock_chart.GetDibMsg1()
         if code != 0:
             self.logger.warning("code : {}, message : {}".format(code, message))
-            raise
+            raise ChartRequestError("code : {}, message : {}".format(code, message))
         if self.verbose:
             self.logger.info("code : {}, message : {}".format(code, message))
 
-    def _get_data_len(self):
-        return self.stock_chart.GetHeaderValue(3)
-
-    def _block_request(self, offset=0, len=0, is_first=True):
+    def _block_request(self):
+        self.budget.wait()
         self.stock_chart.BlockRequest()
         self.log_request()
-        _offset = 0 if is_first else offset + len
-        _len = self._get_data_len()
-        return _offset, _len
-
-    def consume(self):
 
+    def fetch(self, stockcode, group, progress=None):
+        """
+        stream every block of stockcode to the datasets of group as it arrives,
+        at most the newest opt.datalen rows
+        :param progress: tqdm bar updated with the rows of each block
+        :return: number of rows written
+        """
+        self._set(stockcode)
+        stream = ColumnStream(group, self.columns, self.layout)
+        while len(stream) < self.opt.datalen:
+            self._block_request()
+            self.reader.read_block()
+            block = self.reader.drain()
+            # blocks come newest first, the oldest rows of the last one are left out
+            remaining = self.opt.datalen - len(stream)
+            block = {name: values[-remaining:] for name, values in block.items()}
+            if progress is not None:
+                progress.update(len(block[self.columns[0][1]]))
+            stream.write(block)
+            if not self.stock_chart.Continue:
+                break
+        return stream.finish()
+
+    def _export(self, name):
         if not os.path.exists(self.opt.export_to):
             os.makedirs(self.opt.export_to)
-        self.logger.info("load request format")
-        self._set()
-
-        res = list()
-        offset, _len = self._block_request()
-        for i in tqdm.tqdm(range(self.opt.datalen)):
-            if i == _len + offset:
+        return pjoin(self.opt.export_to, "{}.h5".format(name))
 
-                if not self.stock_chart.Continue:
-                    break
-                offset, _len = self._block_request(offset=offset,
-                                                   len=_len,
-                                                   is_first=False)
-                if self.status.getLimitRemainCount(1) < 2:
-                    time.sleep(15.0)
-
-            res.append(self._get_tuple(i-offset))
-
-        self.save(res)
-
-    def save(self, res):
-        res = {key: [item[key] for item in res]
-               for key in self.opt.format.values()}
-        with h5py.File(pjoin(self.opt.export_to, "{}.h5".format(self.opt.stockcode)), "w") as f:
-            for key, value in res.items():
-                f.create_dataset(key, data=value)
+    def consume(self):
+        """
+        stream opt.stockcode to <stockcode>.h5, in chronological order
+        """
+        path = self._export(self.opt.stockcode)
+        self.logger.info("load request format")
+        with h5py.File(staging_path(path), "w") as f:
+            with tqdm.tqdm(total=self.opt.datalen) as progress:
+                self.fetch(self.opt.stockcode, f, progress)
+        commit_staging(path)
+
+    def batch(self, codes=None, markets=(1, 2), sections=None, listed_before=None,
+              name="timeseries", resume=False):
+        """
+        fetch many stocks into one <name>.h5, one group per stock, with a single
+        dispatch and request budget
+        :param codes: comma separated stock codes, the stock universe filtered by
+            markets, sections and listed_before if omitted
+        :param resume: skip stocks completed by an interrupted batch
+        """
+        self.get_dispatch()
+        if codes is None:
+            universe = open_universe(self, self.dispatch("CpUtil.CpCodeMgr"))
+            codes = universe.codes(markets, sections, listed_before)
+        elif isinstance(codes, str):
+            codes = codes.split(",")
+        path = self._export(name)
+        self.logger.info("batch of {} stocks to {}".format(len(codes), path))
+        start, rows = time.time(), 0
+
+        def save_stock(fout, stockcode):
+            nonlocal rows
+            if stockcode in fout:
+                del fout[stockcode]
+            written = self.fetch(stockcode, fout.create_group(stockcode))
+            if not written:
+                del fout[stockcode]
+            rows += written
+
+        crawl_codes(self.opt.export_to, name, codes, save_stock, resume=resume)
+        elapsed = time.time() - start
+        self.logger.info("batch : {} stocks, {} rows in {:.1f}s, {:.1f} rows/sec".format(
+            len(codes), rows, elapsed, rows / max(elapsed, 1e-9)))
+        self.logger.info("request budget : {}".format(self.budget.summary()))
 
     def run(self):
         self.get_dispatch()
         self.consume()
+        self.logger.info("request budget : {}".format(self.budget.summary()))
 
 if __name__ == "__main__":
     fire.Fire(TImeSeries)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import numpy as np
+
+from store import bisect
+
+
+PRICE_COLUMNS = ["opens", "highs", "lows", "closes"]
+
+
+def row_keys(record):
+    keys = record["dates"].astype(np.int64) * 10000
+    if "minutes" in record:
+        keys += record["minutes"]
+    return keys
+
+
+def _factor(stored, fresh, ticks, tolerance):
+    """
+    ratio fresh / stored shared by every row within rounding,
+    1.0 if the values are equal and None if there is no such ratio
+    """
+    if np.array_equal(stored, fresh):
+        return 1.0
+    rows = stored != 0
+    if not rows.any():
+        return None
+    factor = float(np.median(fresh[rows] / stored[rows].astype(np.float64)))
+    error = np.abs(np.round(stored * factor) - fresh)
+    if np.all(error <= ticks + tolerance * np.abs(fresh)):
+        return factor
+    return None
+
+
+def restatement(stored, fresh, ticks=1, tolerance=1e-3):
+    """
+    compare the overlapping rows of stored and freshly fetched bars.
+    adjusted prices restate the whole history on splits and dividends, which
+    shows as a common ratio between old and new values of the same bar
+    :param stored: {name: values} of stored rows
+    :param fresh: {name: values} of the same period fetched now
+    :param ticks: rounding error allowed on rescaled values
+    :return: {column name: factor} of restated columns, empty if nothing changed
+        or the periods do not overlap, None if the change is no common ratio
+    """
+    stored_keys, fresh_keys = row_keys(stored), row_keys(fresh)
+    keys = np.intersect1d(stored_keys, fresh_keys)
+    if not len(keys):
+        return {}
+    # both sides are sorted by (date, minute)
+    stored_rows = np.searchsorted(stored_keys, keys)
+    fresh_rows = np.searchsorted(fresh_keys, keys)
+    price = _factor(stored["closes"][stored_rows], fresh["closes"][fresh_rows], ticks, tolerance)
+    if price is None:
+        return None
+    factors = {}
+    for name in PRICE_COLUMNS:
+        factor = _factor(stored[name][stored_rows], fresh[name][fresh_rows], ticks, tolerance)
+        if factor is None or abs(factor - price) > tolerance * price:
+            return None
+        if price != 1.0:
+            factors[name] = price
+    if "volumes" in stored:
+        volume = _factor(stored["volumes"][stored_rows], fresh["volumes"][fresh_rows], ticks, tolerance)
+        if volume is None:
+            return None
+        if volume != 1.0:
+            factors["volumes"] = volume
+    return factors
+
+
+def stored_overlap(group, overlap, end):
+    """rows of group before end dated inside the overlap"""
+    if not len(overlap["dates"]):
+        return None
+    start = bisect(group["dates"], overlap["dates"][0], 0, end)
+    return {name: group[name][start:end] for name in overlap}
+
+
+def rescale(group, factors, end, step=65536):
+    """multiply rows [0, end) of group by factors, rounded to the column dtype"""
+    for name, factor in factors.items():
+        dataset = group[name]
+        for start in range(0, end, step):
+            values = dataset[start:min(start + step, end)]
+            dataset[start:start + len(values)] = np.round(values * factor).astype(dataset.dtype)
+
+
+def reconcile(group, overlap, end, policy="refetch", watermark=None):
+    """
+    check the stored rows of group before end against overlap, rows of the
+    same period fetched now, and rescale them if the policy allows
+    :param policy: "rescale" to rescale by a common ratio, "refetch" to leave
+        restated stocks to the caller
+    :param watermark: (date, minute) or (date,) of the newest stored bar. it
+        may have been stored while still moving, so only rows before it count
+        as evidence and the caller writes it again
+    :return: "unchanged", "rescaled" or "refetch"
+    """
+    if watermark is not None:
+        key = watermark[0] * 10000 + (watermark[1] if len(watermark) > 1 else 0)
+        rows = row_keys(overlap) < key
+        overlap = {name: values[rows] for name, values in overlap.items()}
+    stored = stored_overlap(group, overlap, end)
+    if stored is None:
+        return "unchanged"
+    factors = restatement(stored, overlap)
+    if factors == {}:
+        return "unchanged"
+    if factors is None or policy != "rescale":
+        return "refetch"
+    rescale(group, factors, end)
+    return "rescaled"
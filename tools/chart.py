@@ -0,0 +1,177 @@
+import math
+import numpy as np
+
+
+# (StockChart field, column name, dtype) in request order
+MINUTE_COLUMNS = [
+    (0, "dates", "int32"),
+    (1, "minutes", "int16"),
+    (2, "opens", "int32"),
+    (3, "highs", "int32"),
+    (4, "lows", "int32"),
+    (5, "closes", "int32"),
+    (8, "volumes", "uint64"),
+]
+
+DATE_COLUMNS = [
+    (0, "dates", "int32"),
+    (2, "opens", "int32"),
+    (3, "highs", "int32"),
+    (4, "lows", "int32"),
+    (5, "closes", "int32"),
+    (8, "volumes", "uint64"),
+]
+
+
+# dtype of each StockChart field, ratios and other fields not listed are float32
+FIELD_DTYPES = {
+    0: "int32",     # date
+    1: "int16",     # time, hhmm
+    2: "int32",     # open
+    3: "int32",     # high
+    4: "int32",     # low
+    5: "int32",     # close
+    8: "uint64",    # volume
+    9: "uint64",    # value
+    12: "uint64",   # listed stocks
+    13: "uint64",   # market cap
+}
+
+
+def field_columns(names):
+    """
+    column spec of {field: name} in request order
+    """
+    return [(int(field), name, FIELD_DTYPES.get(int(field), "float32"))
+            for field, name in sorted(names.items(), key=lambda item: int(item[0]))]
+
+
+class ChartRequestError(Exception):
+    """non-zero GetDibStatus after a BlockRequest"""
+
+
+def chart_fields(columns):
+    return [field for field, _, _ in columns]
+
+
+class ChartReader:
+    """
+    Extract StockChart blocks into preallocated column arrays.
+
+    StockChart returns the newest rows first, so each block is written
+    backwards from the tail of the arrays. The filled part is already in
+    chronological order and `result()` returns views on it without reversing.
+    """
+
+    def __init__(self, stock_chart, columns, capacity=100000):
+        self.stock_chart = stock_chart
+        self.columns = columns
+        self.capacity = capacity
+        # server block size, learnt from blocks followed by more rows, 0 until one arrived
+        self.block_rows = 0
+        self.reset()
+
+    def reset(self, capacity=None):
+        if capacity is not None:
+            self.capacity = capacity
+        self.data = {name: np.empty(self.capacity, dtype=dtype)
+                     for _, name, dtype in self.columns}
+        self.head = self.capacity
+        self.blocks = 0
+        self.received = 0
+        # rows before the watermark, oldest block first
+        self.overlap = {name: np.empty(0, dtype=dtype) for _, name, dtype in self.columns}
+
+    def __len__(self):
+        return self.capacity - self.head
+
+    def _grow(self, length):
+        extra = max(length, self.capacity)
+        for _, name, dtype in self.columns:
+            self.data[name] = np.concatenate([np.empty(extra, dtype=dtype), self.data[name]])
+        self.head += extra
+        self.capacity += extra
+
+    def _count_newer(self, keys, oldest):
+        for count, key in enumerate(keys):
+            if key < oldest:
+                return count
+        return len(keys)
+
+    def read_block(self, cutoff=None, watermark=None):
+        """
+        read the current block with one GetDataValue call per cell
+        :param cutoff: oldest date to keep, older rows are dropped
+        :param watermark: values of the leading columns of the newest stored row,
+            e.g. (date, minute). rows before it are kept apart in `overlap`, the
+            row at the watermark is read again like newer ones
+        :return: True if the block reached the cutoff or the watermark
+        """
+        length = self.stock_chart.GetHeaderValue(3)
+        self.blocks += 1
+        if self.stock_chart.Continue:
+            # a block cut short by the end of the data does not show the block size
+            self.block_rows = max(self.block_rows, length)
+        self.received += max(length, 0)
+        if length <= 0:
+            return False
+        get = self.stock_chart.GetDataValue
+        fetched = {0: [get(0, i) for i in range(length)]}
+        count = length if cutoff is None else self._count_newer(fetched[0], cutoff)
+        if watermark is not None:
+            watermark = tuple(watermark)
+            for column in range(1, len(watermark)):
+                fetched[column] = [get(column, i) for i in range(count)]
+            keys = list(zip(*[fetched[column][:count] for column in range(len(watermark))]))
+            newer = self._count_newer(keys, watermark)
+            self._keep_overlap(fetched, newer, count)
+            count = newer
+        if count > self.head:
+            self._grow(count)
+        start, end = self.head - count, self.head
+        for column, (_, name, _) in enumerate(self.columns):
+            if column in fetched:
+                values = fetched[column][:count]
+            else:
+                values = [get(column, i) for i in range(count)]
+            values.reverse()
+            self.data[name][start:end] = values
+        self.head = start
+        return count < length
+
+    def _keep_overlap(self, fetched, start, end):
+        """keep rows [start, end) of the block, already stored rows to compare against"""
+        if start >= end:
+            return
+        get = self.stock_chart.GetDataValue
+        for column, (_, name, dtype) in enumerate(self.columns):
+            if column in fetched:
+                values = fetched[column][start:end]
+            else:
+                values = [get(column, i) for i in range(start, end)]
+            values = np.array(values[::-1], dtype=dtype)
+            self.overlap[name] = np.concatenate([values, self.overlap[name]])
+
+    def saved_blocks(self, count, history=0):
+        """
+        blocks a count request of `count` rows would have needed beyond this one.
+        Only rows known to exist are counted, the ones received and `history`
+        stored rows older than them, so it is a lower bound
+        :return: None until a full block was received
+        """
+        if not self.block_rows:
+            return None
+        rows = min(count, self.received + history)
+        return max(math.ceil(rows / self.block_rows) - self.blocks, 0)
+
+    def result(self):
+        return {name: self.data[name][self.head:] for _, name, _ in self.columns}
+
+    def drain(self):
+        """
+        rows read so far as views, then empty the reader without reallocating.
+        the views are overwritten by the next read_block
+        """
+        rows = self.result()
+        self.head = self.capacity
+        return rows
@@ -0,0 +1,38 @@
+import os
+
+
+class Checkpoint:
+    """
+    Append-only journal of stock codes whose output is durably written.
+
+    One code per line, fsync'ed after each mark so an interrupted crawl can
+    be resumed without fetching completed stocks again. The journal is
+    removed once the crawl finishes, together with the commit of its output.
+    :param path: journal file
+    :param resume: keep the codes of a previous run, otherwise start over.
+        only pass it when the output the journal describes still exists
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = set()
+        if resume and os.path.exists(path):
+            with open(path, "r") as fin:
+                self.done = {line.strip() for line in fin if line.strip()}
+        self.fout = open(path, "a" if resume else "w")
+
+    def __contains__(self, code):
+        return code in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def mark(self, code):
+        self.fout.write(code + "\n")
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+        self.done.add(code)
+
+    def close(self):
+        self.fout.close()
+        os.remove(self.path)
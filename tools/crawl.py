@@ -0,0 +1,220 @@
+import os
+import datetime
+import tqdm
+import h5py
+from os.path import join as pjoin
+
+from misc import get_logger
+from login import Status
+from checkpoint import Checkpoint
+from storage import ColumnStream, trim_columns, drop_last, last_row, open_layout, staging_path, commit_staging
+from adjust import reconcile
+from shard import select, shard_name, write_manifest, merge_shards
+from chart import ChartRequestError, ChartReader, chart_fields
+from universe import open_universe
+
+
+def crawl_codes(export_to, name, codes, save, resume=False, in_place=False):
+    """
+    call save(fout, code) for every code into <name>.h5, journalled so an
+    interrupted crawl is continued with resume.
+    A crawl is written to <name>.h5.part and moved over <name>.h5 once
+    complete. in_place appends to <name>.h5 itself, groups left by an
+    interrupted run are cut back by trim_columns then
+    :return: codes with a group in the file
+    """
+    logger = get_logger()
+    path = pjoin(export_to, name + ".h5")
+    target = path if in_place else staging_path(path, resume=resume)
+    # a journal is only valid with the file it was written with
+    checkpoint = Checkpoint(pjoin(export_to, name + ".journal"),
+                            resume=resume and os.path.exists(target))
+    with h5py.File(target, "a") as fout:
+        try:
+            for code in tqdm.tqdm(codes):
+                if code in checkpoint:
+                    continue
+                save(fout, code)
+                fout.flush()
+                checkpoint.mark(code)
+        except Exception:
+            logger.error("stopped at {} after {} stocks, rerun with --resume".format(
+                code, len(checkpoint)))
+            raise
+        written = list(fout.keys())
+    if not in_place:
+        commit_staging(path)
+    # removed right after the commit, nothing else may fail in between
+    checkpoint.close()
+    return written
+
+
+class BarCrawler(Status):
+    """
+    Crawler of one StockChart period into <name>.h5, one group of columns
+    per stock, shared by Minute and DateData.
+    Subclasses set NAME, COLUMNS, the (field, name, dtype) column spec, PERIOD,
+    the StockChart period, and KEYS, the leading columns identifying a bar.
+    """
+
+    NAME = None
+    COLUMNS = None
+    PERIOD = None
+    KEYS = ["dates"]
+
+    def __init__(self, conf="./config/stock_minute.json", verbose=False, backend="com"):
+        Status.__init__(self, conf=conf, verbose=verbose, backend=backend)
+        self.logger = get_logger()
+        if not os.path.isdir(self.opt.export_to):
+            os.mkdir(self.opt.export_to)
+
+        self.stock_chart = None
+        self.stock_code = None
+        self.reader = None
+        self.requested_blocks = {}
+        self.saved_blocks = {}
+        self.layout = open_layout(self)
+        self.overlap = None
+        self.restated = {}
+
+    def get_dispatch(self):
+        self.assert_disconnect()
+        self.stock_chart = self.dispatch("CpSysDib.StockChart")
+        self.stock_code = self.dispatch("CpUtil.CpCodeMgr")
+        self.universe = open_universe(self, self.stock_code)
+        self.reader = ChartReader(self.stock_chart, self.COLUMNS)
+
+    def get_stockcode(self):
+        stockcodes = self.universe.codes(markets=(1, 2))
+        self.logger.info("Get stock list : {}".format(len(stockcodes)))
+        return stockcodes
+
+    def log_request(self):
+        code = self.stock_chart.GetDibStatus()
+        message = self.stock_chart.GetDibMsg1()
+        if code != 0:
+            self.logger.warning("code : {}, message : {}".format(code, message))
+            raise ChartRequestError("code : {}, message : {}".format(code, message))
+        if self.verbose:
+            self.logger.info("code : {}, message : {}".format(code, message))
+
+    def overlap_start(self, watermark):
+        """first date requested again in incremental mode, the watermark date"""
+        return watermark[0]
+
+    def get_data(self, stock_code, watermark=None, stream=None):
+        """
+        :param watermark: newest stored row, the request stops once it is passed
+        :param stream: ColumnStream each block is written to as it arrives,
+            nothing is kept in memory then
+        """
+        count = 100000
+        startdate = self.opt.todate
+        if watermark is not None:
+            startdate = max(startdate or 0, self.overlap_start(watermark))
+        self.stock_chart.SetInputValue(0, stock_code)
+        if startdate:
+            # period request, the server stops at startdate by itself
+            self.stock_chart.SetInputValue(1, ord('1'))
+            self.stock_chart.SetInputValue(2, int(datetime.datetime.now().strftime("%Y%m%d")))
+            self.stock_chart.SetInputValue(3, startdate)
+        else:
+            self.stock_chart.SetInputValue(1, ord('2'))
+        self.stock_chart.SetInputValue(4, count)
+        self.stock_chart.SetInputValue(5, chart_fields(self.COLUMNS))
+        self.stock_chart.SetInputValue(6, ord(self.PERIOD))
+        self.stock_chart.SetInputValue(9, ord('1'))
+        self.stock_chart.SetInputValue(10, ord('3'))
+        self.reader.reset()
+        while True:
+            self.budget.wait()
+            self.stock_chart.BlockRequest()
+            self.log_request()
+            reached = self.reader.read_block(cutoff=self.opt.todate, watermark=watermark)
+            if stream is not None:
+                stream.write(self.reader.drain())
+            if reached or not self.stock_chart.Continue:
+                break
+        self.overlap = self.reader.overlap
+        # the count request also returned the stored rows that were not refetched
+        history = 0 if stream is None else stream.base - len(self.overlap["dates"])
+        self.requested_blocks[stock_code] = self.reader.blocks
+        saved = self.reader.saved_blocks(count, history)
+        if saved is not None:
+            self.saved_blocks[stock_code] = saved
+        self.logger.debug("{} blocks : {}, saved : {}".format(stock_code, self.reader.blocks, saved))
+        return self.reader.result()
+
+    def save_stock(self, fout, stock_code, incremental=False):
+        """
+        fetch one stock and stream it to fout
+        a group left by an interrupted run is refetched, or trimmed and appended to
+        in incremental mode. The newest stored bar may have been written while
+        it was still moving, it is dropped and requested again from the watermark
+        """
+        watermark = None
+        if stock_code in fout:
+            if incremental:
+                trim_columns(fout[stock_code])
+                watermark = last_row(fout[stock_code], self.KEYS)
+                if watermark is not None:
+                    drop_last(fout[stock_code], self.layout)
+            else:
+                del fout[stock_code]
+        created = stock_code not in fout
+        group = fout.require_group(stock_code)
+        stream = ColumnStream(group, self.COLUMNS, self.layout)
+        self.get_data(stock_code, watermark=watermark, stream=stream)
+        rows = stream.finish()
+        if watermark is not None:
+            # adjusted prices of stored rows change on splits and dividends
+            result = reconcile(group, self.overlap, stream.base, self.opt.get("restated", "refetch"),
+                               watermark)
+            if result != "unchanged":
+                self.logger.warning("{} restated, {}".format(stock_code, result))
+                self.restated[stock_code] = result
+            if result == "refetch":
+                del fout[stock_code]
+                return self.save_stock(fout, stock_code)
+        if not rows and created:
+            del fout[stock_code]
+
+    def run(self, incremental=False, resume=False, shard=None, shards=1):
+        """
+        :param incremental: append only bars newer than the last stored row of each stock
+        :param resume: skip stocks completed by an interrupted run
+        :param shard: index of this worker when the universe is split into `shards`,
+            writes a shard file and manifest to be combined by merge
+        """
+        self.get_dispatch()
+        stock_codes = self.get_stockcode()
+        name = self.NAME
+        if shard is not None:
+            stock_codes = select(stock_codes, shard, shards)
+            name = shard_name(name, shard, shards)
+        written = crawl_codes(self.opt.export_to, name, stock_codes,
+                              lambda fout, stock_code: self.save_stock(fout, stock_code, incremental),
+                              resume=resume, in_place=incremental)
+        listed = set(stock_codes)
+        stored_codes = [code for code in written if code not in listed]
+        if shard is None:
+            with open(pjoin(self.opt.export_to, self.NAME + ".keys"), "w") as fout:
+                fout.write("\n".join(stock_codes + stored_codes))
+        else:
+            write_manifest(self.opt.export_to, self.NAME, shard, shards,
+                           stock_codes + stored_codes, written)
+        self.logger.info("requested blocks : {} over {} stocks".format(
+            sum(self.requested_blocks.values()), len(self.requested_blocks)))
+        if self.saved_blocks:
+            self.logger.info("saved blocks : at least {} over {} stocks".format(
+                sum(self.saved_blocks.values()), len(self.saved_blocks)))
+        if self.restated:
+            self.logger.info("restated : {} stocks, {}".format(len(self.restated), self.restated))
+        self.logger.info("request budget : {}".format(self.budget.summary()))
+
+    def merge(self, shards):
+        """
+        merge shard files of `run --shard=i --shards=N` workers into <name>.h5
+        """
+        codes = merge_shards(self.opt.export_to, self.NAME, shards)
+        self.logger.info("merged {} stocks from {} shards".format(len(codes), shards))
@@ -0,0 +1,186 @@
+import datetime
+from functools import reduce
+from os.path import join as pjoin
+import h5py
+import numpy as np
+
+from chart import ChartReader
+from planner import to_date
+
+
+DAILY_STORE = pjoin("res", "daily_store.h5")
+
+
+def from_date(day):
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def shift_date(date, days):
+    return from_date(to_date(date) + datetime.timedelta(days=days))
+
+
+def today():
+    return from_date(datetime.date.today())
+
+
+def request_daily(status, stock_code, fields, start, end):
+    """
+    period request of daily fields through status.stock_chart
+    :param status: Status subclass with stock_chart, budget and log_request
+    :return: {field: values} ordered by date, field 0 holds the dates
+    """
+    stock_chart = status.stock_chart
+    stock_chart.SetInputValue(0, stock_code)
+    stock_chart.SetInputValue(1, ord('1'))
+    stock_chart.SetInputValue(2, end)
+    stock_chart.SetInputValue(3, start)
+    stock_chart.SetInputValue(5, fields)
+    stock_chart.SetInputValue(6, ord("D"))
+    stock_chart.SetInputValue(9, ord('1'))
+    reader = ChartReader(stock_chart, [(field, field, "int32" if field == 0 else "float64")
+                                       for field in fields], capacity=4096)
+    while True:
+        status.budget.wait()
+        stock_chart.BlockRequest()
+        status.log_request()
+        reader.read_block()
+        if not stock_chart.Continue:
+            break
+    return reader.result()
+
+
+def open_daily_store(status, path=DAILY_STORE):
+    """
+    store fetching through status, opt.daily_store overrides the path
+    and an empty value disables it
+    """
+    path = status.opt.get("daily_store", path)
+    if not path:
+        return None
+    return DailyStore(path, lambda *args: request_daily(status, *args),
+                      overlap_days=status.opt.get("overlap_days", 7))
+
+
+class DailyStore:
+    """
+    On-disk daily bars keyed by (stock code, StockChart field).
+
+    Each field keeps its own dates, values and the [start, end] range that was
+    requested for it, so consumers asking for overlapping fields or dates
+    only send requests for what is not stored yet.
+
+    Requests after the stored range start `overlap_days` early. Adjusted
+    prices restate the whole history on splits and dividends, so a stock whose
+    overlapping rows changed is dropped and fetched again.
+
+    The stored range ends before today, whose bar is still moving, and attrs
+    fetched holds the newest date requested. Rows up to it are served without
+    a request until the next day, so repeating a job costs no quota.
+
+    /<stock code>/<field>/dates, values, attrs start, end, fetched
+    :param path: HDF5 file of the store
+    :param fetch: fetch(stock_code, fields, start, end) -> {field: values},
+        see request_daily
+    :param overlap_days: calendar days refetched before the end of the stored range
+    """
+
+    def __init__(self, path, fetch, overlap_days=7):
+        self.path = path
+        self.fetch = fetch
+        self.overlap_days = overlap_days
+        self.requests = 0
+        self.restated = []
+
+    def coverage(self, fout, stock_code, field):
+        """stored start, end and fetched date of field, None if it is not stored"""
+        name = "{}/{}".format(stock_code, field)
+        if name not in fout:
+            return None
+        attrs = fout[name].attrs
+        return attrs["start"], attrs["end"], attrs.get("fetched", attrs["end"])
+
+    def gaps(self, fout, stock_code, field, start, end):
+        """date ranges to request so the stored range of field contains [start, end]"""
+        covered = self.coverage(fout, stock_code, field)
+        if covered is None:
+            return [(start, end)]
+        gaps = []
+        if start < covered[0]:
+            gaps.append((start, shift_date(covered[0], -1)))
+        if end > covered[2]:
+            gaps.append((max(shift_date(covered[1], 1 - self.overlap_days), covered[0]), end))
+        return gaps
+
+    def write(self, fout, stock_code, field, dates, values, start, end, fetched):
+        """
+        merge rows into the stored field, new values win on the same date
+        :param fetched: newest date requested, end is capped before today
+        :return: True if rows inside the stored range changed
+        """
+        name = "{}/{}".format(stock_code, field)
+        restated = False
+        if name in fout:
+            group = fout[name]
+            fetched = max(fetched, group.attrs.get("fetched", group.attrs["end"]))
+            stored_dates, stored_values = group["dates"][...], group["values"][...]
+            common = np.intersect1d(stored_dates, dates)
+            common = common[common <= group.attrs["end"]]
+            restated = not np.array_equal(stored_values[np.searchsorted(stored_dates, common)],
+                                          values[np.searchsorted(dates, common)])
+            dates = np.concatenate([dates, stored_dates])
+            values = np.concatenate([values, stored_values])
+            start = min(start, group.attrs["start"])
+            end = max(end, group.attrs["end"])
+            del fout[name]
+        dates, index = np.unique(dates, return_index=True)
+        group = fout.create_group(name)
+        group.create_dataset("dates", data=dates.astype(np.int32))
+        group.create_dataset("values", data=values[index])
+        group.attrs["start"] = start
+        group.attrs["end"] = end
+        group.attrs["fetched"] = fetched
+        return restated
+
+    def update(self, fout, stock_code, fields, start, end):
+        pending = {}
+        for field in fields:
+            for gap in self.gaps(fout, stock_code, field, start, end):
+                pending.setdefault(gap, []).append(field)
+        # today's bar is still moving, keep it outside the stored range
+        last_closed = shift_date(today(), -1)
+        restated = False
+        for (gap_start, gap_end), gap_fields in pending.items():
+            data = self.fetch(stock_code, [0] + gap_fields, gap_start, gap_end)
+            self.requests += 1
+            for field in gap_fields:
+                restated |= self.write(fout, stock_code, field, data[0], data[field],
+                                       gap_start, min(gap_end, last_closed), min(gap_end, today()))
+        if restated:
+            del fout[stock_code]
+            self.restated.append(stock_code)
+            self.update(fout, stock_code, fields, start, end)
+
+    def get(self, stock_code, columns, start, end=None):
+        """
+        :param columns: (field, name, dtype) column spec, field 0 is the date
+        :return: {name: array} of dates in [start, end] stored for every field
+        """
+        end = end or today()
+        fields = [field for field, _, _ in columns if field != 0]
+        with h5py.File(self.path, "a") as fout:
+            self.update(fout, stock_code, fields, start, end)
+            stored = {}
+            for field in fields:
+                group = fout["{}/{}".format(stock_code, field)]
+                dates = group["dates"][...]
+                rows = (start <= dates) & (dates <= end)
+                stored[field] = dates[rows], group["values"][...][rows]
+        dates = reduce(np.intersect1d, [dates for dates, _ in stored.values()])
+        record = {}
+        for field, name, dtype in columns:
+            if field == 0:
+                record[name] = dates.astype(dtype)
+                continue
+            field_dates, values = stored[field]
+            record[name] = values[np.searchsorted(field_dates, dates)].astype(dtype)
+        return record
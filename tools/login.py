@@ -1,12 +1,33 @@
-import win32com.client
+import time
+try:
+    import win32com.client
+except ImportError:
+    # Cybos only runs on Windows, the sim backend works without it
+    win32com = None
 from misc import get_logger, Option
+import simulator
+
+LT_TRADE_REQUEST = 0
+LT_NONTRADE_REQUEST = 1
+LT_SUBSCRIBE = 2
 
 class Status:
-    def __init__(self, conf, verbose=False):
+    """
+    :param backend: "com" for Cybos, "sim" for the in-process stand-ins of
+        simulator.py with a virtual clock
+    """
+    def __init__(self, conf, verbose=False, backend="com"):
         self.logger = get_logger()
         self.verbose = verbose
-        self.status = CpCybos.get_instance()
+        self.backend = backend
         self.opt = Option(conf)
+        if backend == "sim":
+            clock = simulator.SimClock()
+            self.status = simulator.SimCybos(clock=clock)
+            self.budget = RequestBudget(self.status, clock=clock.time, sleep=clock.sleep)
+        else:
+            self.status = CpCybos.get_instance()
+            self.budget = RequestBudget(self.status)
 
     def assert_disconnect(self):
         assert self.status.getIsConnect()
@@ -14,6 +35,66 @@ class Status:
     def get_dispatch(self):
         raise NotImplementedError
 
+    def dispatch(self, name):
+        if self.backend == "sim":
+            return simulator.dispatch(name, self.status)
+        return win32com.client.Dispatch(name)
+
+class RequestBudget:
+    """
+    Pace requests against the Cybos request quota.
+
+    Rather than sleeping a fixed time when the quota runs low, wait only
+    until the window refills and spread the remaining requests evenly over
+    the rest of the window so the quota is used without bursts.
+    :param status: CpCybos instance
+    :param limit_type: quota to track, LT_NONTRADE_REQUEST for charts
+    :param reserve: requests left untouched in each window
+    :param smooth: spread requests evenly over the window
+    """
+
+    def __init__(self, status, limit_type=LT_NONTRADE_REQUEST, reserve=1, smooth=True,
+                 clock=time.time, sleep=time.sleep, poll=0.05):
+        self.status = status
+        self.limit_type = limit_type
+        self.reserve = reserve
+        self.smooth = smooth
+        self.clock = clock
+        self.sleep = sleep
+        self.poll = poll
+        self.waited = 0.0
+        self.requests = 0
+        self._last = None
+
+    def _remain_time(self):
+        return self.status.getLimitRequestRemainTime() / 1000.0
+
+    def _sleep(self, delay):
+        self.sleep(delay)
+        self.waited += delay
+        return delay
+
+    def wait(self):
+        """
+        block until one more request fits in the quota
+        :return: seconds waited for this request
+        """
+        waited = 0.0
+        remain = self.status.getLimitRemainCount(self.limit_type)
+        while remain <= self.reserve:
+            waited += self._sleep(max(self._remain_time(), self.poll))
+            remain = self.status.getLimitRemainCount(self.limit_type)
+        if self.smooth and self._last is not None and not waited:
+            delay = self._last + self._remain_time() / (remain - self.reserve) - self.clock()
+            if delay > 0:
+                waited += self._sleep(delay)
+        self._last = self.clock()
+        self.requests += 1
+        return waited
+
+    def summary(self):
+        return "requests : {}, waited : {:.1f}s".format(self.requests, self.waited)
+
 class CpCybos:
 
     def __init__(self):
@@ -0,0 +1,52 @@
+import datetime
+
+
+def to_date(date):
+    return datetime.date(date // 10000, date // 100 % 100, date % 100)
+
+
+class PivotPlanner:
+    """
+    Plan sparse minute requests around pivot dates.
+
+    Sorted pivot dates are grouped into period ranges, so requests only cover
+    days holding a pivot, apart from gaps short enough that reading through
+    them is cheaper than starting another request.
+    :param window: intraday [from, to) HHMM window kept on pivot dates
+    :param max_gap: calendar days between pivots still read in one range
+    """
+
+    def __init__(self, window=(901, 1130), max_gap=3):
+        self.window = tuple(window)
+        self.max_gap = max_gap
+
+    def ranges(self, pivots, startdate=None):
+        """
+        :param pivots: pivot dates as YYYYMMDD ints
+        :param startdate: pivots older than this are dropped
+        :return: [(start, end), ...] newest range first
+        """
+        ranges = []
+        for date in sorted(set(pivots)):
+            if startdate and date < startdate:
+                continue
+            if ranges and (to_date(date) - to_date(ranges[-1][1])).days <= self.max_gap:
+                ranges[-1][1] = date
+            else:
+                ranges.append([date, date])
+        return [(start, end) for start, end in reversed(ranges)]
+
+    def plan(self, stock_map, startdate=None):
+        """
+        :param stock_map: {stockcode: pivot dates}
+        :return: {stockcode: ranges} for stocks with at least one range
+        """
+        plans = {}
+        for stockcode, pivots in stock_map.items():
+            ranges = self.ranges(pivots, startdate)
+            if ranges:
+                plans[stockcode] = ranges
+        return plans
+
+    def in_window(self, minute):
+        return self.window[0] <= minute < self.window[1]
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+# StockChart daily fields that can drive a ranking
+RANK_FIELDS = {
+    "volume": 8,
+    "value": 9,
+    "turnover": 25,
+}
+
+
+class CrossSection:
+    """
+    Dense date x stock matrix of one daily field with a missing-value mask.
+
+    Rows are sorted dates and columns follow the order of `series`, so
+    cross-sectional screens run as array operations instead of per-date
+    Python loops.
+    :param series: {stockcode: (dates, values)}
+    """
+
+    def __init__(self, series):
+        self.codes = list(series.keys())
+        columns = [(np.asarray(dates, dtype=np.int64), np.asarray(values, dtype=np.float64))
+                   for dates, values in series.values()]
+        if columns:
+            self.dates = np.unique(np.concatenate([dates for dates, _ in columns]))
+        else:
+            self.dates = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((len(self.dates), len(self.codes)), dtype=np.float64)
+        self.mask = np.zeros(self.matrix.shape, dtype=bool)
+        for column, (dates, values) in enumerate(columns):
+            rows = np.searchsorted(self.dates, dates)
+            self.matrix[rows, column] = values
+            self.mask[rows, column] = True
+
+    def rows(self, fromdate=None, todate=None):
+        """row slice of dates in [fromdate, todate]"""
+        start = 0 if not fromdate else np.searchsorted(self.dates, fromdate, side="left")
+        end = len(self.dates) if not todate else np.searchsorted(self.dates, todate, side="right")
+        return slice(start, end)
+
+    def top_k(self, k, fromdate=None, todate=None):
+        """
+        largest k stocks per date by partial selection
+        :return: dates, (dates x k) int array of code indices ordered by value,
+            -1 where a date has fewer than k stocks
+        """
+        rows = self.rows(fromdate, todate)
+        values = np.where(self.mask[rows], self.matrix[rows], -np.inf)
+        k = min(k, values.shape[1])
+        if k == 0:
+            return self.dates[rows], np.zeros((values.shape[0], 0), dtype=np.int64)
+        index = np.arange(values.shape[0])[:, None]
+        top = np.argpartition(-values, k - 1, axis=1)[:, :k]
+        order = np.argsort(-values[index, top], axis=1, kind="mergesort")
+        top = top[index, order]
+        top[~self.mask[rows][index, top]] = -1
+        return self.dates[rows], top
@@ -0,0 +1,104 @@
+import h5py
+import numpy as np
+
+from store import BarStore
+from storage import create_columns
+
+
+OHLCV = ["opens", "highs", "lows", "closes", "volumes"]
+
+
+def to_minutes(hhmm):
+    hhmm = np.asarray(hhmm, dtype=np.int64)
+    return hhmm // 100 * 60 + hhmm % 100
+
+
+def to_hhmm(minutes):
+    return minutes // 60 * 100 + minutes % 60
+
+
+def bounds(keys):
+    """starts and ends of the runs of equal keys, from one comparison of neighbouring rows"""
+    ends = np.append(np.flatnonzero(keys[1:] != keys[:-1]) + 1, len(keys))
+    return np.append(0, ends[:-1]), ends
+
+
+def aggregate(record, keys, labels=None):
+    """
+    OHLCV bars over runs of equal keys, aggregated by ufunc.reduceat
+    :param record: chronological dates, minutes and OHLCV columns
+    :param keys: int64 key of the bar of every row, equal within a bar
+    :param labels: hhmm of the bar of every row, no minutes column if omitted
+    """
+    if not len(keys):
+        bars = {"dates": record["dates"][:0]}
+        if labels is not None:
+            bars["minutes"] = record["minutes"][:0]
+        bars.update((name, record[name][:0]) for name in OHLCV)
+        return bars
+    starts, ends = bounds(keys)
+    bars = {"dates": record["dates"][starts]}
+    if labels is not None:
+        bars["minutes"] = labels[starts].astype(record["minutes"].dtype)
+    bars["opens"] = record["opens"][starts]
+    bars["highs"] = np.maximum.reduceat(record["highs"], starts)
+    bars["lows"] = np.minimum.reduceat(record["lows"], starts)
+    bars["closes"] = record["closes"][ends - 1]
+    bars["volumes"] = np.add.reduceat(record["volumes"], starts).astype(record["volumes"].dtype)
+    return bars
+
+
+def resample_minutes(record, n, session_open=900):
+    """
+    N-minute bars, hourly for n=60, labelled by their closing minute like the
+    1-minute bars, 0901-0905 is the 0905 bar. a bar cut short by the close is
+    labelled by its last minute
+    """
+    minutes = to_minutes(record["minutes"])
+    offset = minutes - to_minutes(session_open)
+    labels = to_minutes(session_open) + ((offset - 1) // n + 1) * n
+    keys = record["dates"].astype(np.int64) * 10000 + labels
+    bars = aggregate(record, keys, to_hhmm(labels))
+    if len(keys):
+        _, ends = bounds(keys)
+        bars["minutes"] = np.minimum(bars["minutes"], record["minutes"][ends - 1])
+    return bars
+
+
+def resample_window(record, start, end):
+    """
+    one bar per date of the minutes in [start, end), e.g. 0901-1130, labelled end.
+    half-open like PivotPlanner.in_window, so the bars match the ninetoten window
+    """
+    rows = (start <= record["minutes"]) & (record["minutes"] < end)
+    record = {name: values[rows] for name, values in record.items()}
+    labels = np.full(len(record["dates"]), end, dtype=np.int64)
+    return aggregate(record, record["dates"].astype(np.int64), labels)
+
+
+def resample_daily(record):
+    """daily bars in the DATE_COLUMNS layout"""
+    return aggregate(record, record["dates"].astype(np.int64))
+
+
+def resample_file(src, dst, n=None, window=None, options=None):
+    """
+    resample every stock of a minute file, group or table layout, into dst
+    :param n: minutes per bar, daily bars if neither n nor window is given
+    :param window: (start, end) hhmm of one bar per date, end excluded
+    :return: number of stocks written, those without bars are left out
+    """
+    written = 0
+    with BarStore(src) as store, h5py.File(dst, "w") as fout:
+        for code in store.keys():
+            record = {name: np.asarray(values) for name, values in store[code].items()}
+            if n:
+                bars = resample_minutes(record, n)
+            elif window:
+                bars = resample_window(record, *window)
+            else:
+                bars = resample_daily(record)
+            if len(bars["dates"]):
+                create_columns(fout.create_group(code), bars, options)
+                written += 1
+        return written
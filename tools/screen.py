@@ -0,0 +1,100 @@
+import numpy as np
+
+
+EVENT_KINDS = ["gap_up", "gap_down", "limit_up", "limit_down", "volume_spike"]
+
+
+def load_columns(store, names=("dates", "opens", "closes", "volumes")):
+    """
+    every stock of a BarStore as one set of columns
+    :return: codes, offsets, {name: values}, rows of codes[i] are offsets[i]:offsets[i + 1]
+    """
+    codes = store.keys()
+    if store.table:
+        return codes, store.offsets, {name: np.asarray(store.columns[name][...]) for name in names}
+    records = [store[code] for code in codes]
+    offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(record["dates"]) for record in records])
+    columns = {name: np.concatenate([np.asarray(record[name]) for record in records])
+               if records else np.empty(0) for name in names}
+    return codes, offsets, columns
+
+
+def price_limit(dates):
+    """KRX daily price limit, 30% from 2015-06-15 and 15% before"""
+    return np.where(dates >= 20150615, 0.30, 0.15)
+
+
+def trailing_mean(values, offsets, window):
+    """
+    mean of the `window` values before each row within its stock, nan while
+    the stock has fewer rows
+    """
+    total = np.cumsum(values, dtype=np.float64)
+    mean = np.full(len(values), np.nan)
+    mean[window + 1:] = (total[window:-1] - total[:-window - 1]) / window
+    if len(values) > window:
+        mean[window] = total[window - 1] / window
+    for start in offsets[:-1]:
+        mean[start:start + window] = np.nan
+    return mean
+
+
+def session_positions(dates):
+    """index of each date among all distinct dates, a counting pass over the yyyymmdd range"""
+    if not len(dates):
+        return dates.astype(np.int64)
+    low = int(dates.min())
+    traded = np.zeros(int(dates.max()) - low + 1, dtype=bool)
+    traded[dates - low] = True
+    return np.cumsum(traded)[dates - low] - 1
+
+
+def screen(codes, offsets, columns, gap=0.01, spike=5.0, window=20, tolerance=0.005):
+    """
+    overnight gaps, limit hits, volume spikes and missing sessions of every
+    stock at once, see load_columns
+    :param gap: open / previous close - 1 reported beyond +-gap
+    :param spike: volume over the mean of the previous `window` days reported above it
+    :param tolerance: distance to the price limit still counted as a hit, tick rounding
+    :return: events {codes, dates, kinds, values} one row per hit, kinds index EVENT_KINDS,
+        summary {codes, rows, missing} one row per stock, missing counts sessions
+        traded by other stocks between the first and last row of the stock
+    """
+    dates = columns["dates"]
+    counts = np.diff(offsets)
+    traded = counts > 0
+
+    # previous close within the same stock, nan on the first row of a stock
+    prev_close = np.empty(len(dates))
+    prev_close[1:] = columns["closes"][:-1]
+    prev_close[offsets[:-1][traded]] = np.nan
+    prev_close[prev_close == 0] = np.nan
+    with np.errstate(invalid="ignore", divide="ignore"):
+        gaps = columns["opens"] / prev_close - 1
+        changes = columns["closes"] / prev_close - 1
+        spikes = columns["volumes"] / trailing_mean(columns["volumes"], offsets, window)
+        limit = price_limit(dates) - tolerance
+        hits = [
+            (gaps, gaps > gap),
+            (gaps, gaps < -gap),
+            (changes, changes >= limit),
+            (changes, changes <= -limit),
+            (spikes, spikes > spike),
+        ]
+    rows = [np.flatnonzero(mask) for _, mask in hits]
+    stock = np.repeat(np.arange(len(codes), dtype=np.int32), counts)
+    events = {
+        "codes": np.concatenate([stock[index] for index in rows]),
+        "dates": np.concatenate([dates[index] for index in rows]),
+        "kinds": np.concatenate([np.full(len(index), kind, dtype=np.int8)
+                                 for kind, index in enumerate(rows)]),
+        "values": np.concatenate([values[index] for (values, _), index in zip(hits, rows)]).astype(np.float32),
+    }
+
+    position = session_positions(dates)
+    expected = np.zeros(len(codes), dtype=np.int64)
+    expected[traded] = position[offsets[1:][traded] - 1] - position[offsets[:-1][traded]] + 1
+    summary = {"codes": np.arange(len(codes), dtype=np.int32), "rows": counts,
+               "missing": expected - counts}
+    return events, summary
@@ -0,0 +1,71 @@
+import os
+import json
+import zlib
+import h5py
+from os.path import join as pjoin
+
+
+def shard_of(code, shards):
+    """stable shard of a stock code, independent of the universe it comes from"""
+    return zlib.crc32(code.encode()) % shards
+
+
+def select(codes, shard, shards):
+    return [code for code in codes if shard_of(code, shards) == shard]
+
+
+def shard_name(name, shard, shards):
+    return "{}.shard-{}-of-{}".format(name, shard, shards)
+
+
+def write_manifest(export_to, name, shard, shards, codes, written):
+    """
+    manifest next to a finished shard file
+    :param codes: stock codes assigned to the shard
+    :param written: stock codes with a group in the shard file
+    """
+    manifest = {
+        "name": name,
+        "shard": shard,
+        "shards": shards,
+        "codes": codes,
+        "written": written,
+    }
+    path = pjoin(export_to, shard_name(name, shard, shards) + ".json")
+    with open(path + ".tmp", "w") as fout:
+        json.dump(manifest, fout)
+    os.replace(path + ".tmp", path)
+
+
+def merge_shards(export_to, name, shards):
+    """
+    merge finished shard files into <name>.h5 and <name>.keys
+    groups are copied in sorted code order so the output does not depend on
+    which worker finished first
+    :return: merged stock codes
+    """
+    manifests = []
+    for shard in range(shards):
+        path = pjoin(export_to, shard_name(name, shard, shards) + ".json")
+        if not os.path.exists(path):
+            raise ValueError("shard {} of {} is not finished: {}".format(shard, shards, path))
+        with open(path, "r") as fin:
+            manifests.append(json.load(fin))
+    sources = {}
+    for manifest in manifests:
+        for code in manifest["written"]:
+            sources[code] = manifest["shard"]
+    codes = sorted(code for manifest in manifests for code in manifest["codes"])
+    shard_files = [h5py.File(pjoin(export_to, shard_name(name, shard, shards) + ".h5"), "r")
+                   for shard in range(shards)]
+    try:
+        with h5py.File(pjoin(export_to, name + ".h5"), "w") as fout:
+            for code in codes:
+                if code in sources:
+                    shard_files[sources[code]].copy(code, fout)
+    finally:
+        for fin in shard_files:
+            fin.close()
+    with open(pjoin(export_to, name + ".keys"), "w") as fout:
+        fout.write("\n".join(codes))
+    return codes
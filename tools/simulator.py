@@ -0,0 +1,482 @@
+import time
+import zlib
+import random
+import datetime
+import threading
+from collections import deque
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+
+def _trading_days(last_date):
+    day = datetime.date(last_date // 10000, last_date // 100 % 100, last_date % 100)
+    while True:
+        if day.weekday() < 5:
+            yield day.year * 10000 + day.month * 100 + day.day
+        day = day - datetime.timedelta(days=1)
+
+
+class SimClock:
+    """virtual clock, sleep advances time immediately"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.0)
+
+
+class SimCybos:
+    """
+    In-process stand-in for CpUtil.CpCybos with a fixed-window request quota.
+    Requests over the limit are counted in `violations`, where the real
+    server would reject them.
+    """
+
+    def __init__(self, limit=60, window=15.0, clock=time):
+        self.IsConnect = 1
+        self.ServerType = 1
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.violations = 0
+        self._start = None
+        self._count = 0
+
+    def _refresh(self):
+        if self._start is not None and self.clock.time() - self._start >= self.window:
+            self._start, self._count = None, 0
+
+    def consume(self):
+        self._refresh()
+        if self._start is None:
+            self._start = self.clock.time()
+        if self._count >= self.limit:
+            self.violations += 1
+        self._count += 1
+
+    def getIsConnect(self):
+        return self.IsConnect
+
+    def getServerType(self):
+        return self.ServerType
+
+    def getLimitRemainCount(self, limitType):
+        self._refresh()
+        return max(self.limit - self._count, 0)
+
+    def getLimitRequestRemainTime(self):
+        self._refresh()
+        if self._start is None:
+            return 0
+        return int((self._start + self.window - self.clock.time()) * 1000)
+
+
+class SimStockChart:
+    """
+    In-process stand-in for CpSysDib.StockChart.
+
+    Serves deterministic synthetic bars for any stock code so chart code
+    paths can be run and measured without a Cybos session.
+    :param last_date: newest trading date served
+    :param days: trading days of history for the oldest listed stock
+    :param block_size: max rows returned by one BlockRequest
+    :param status: SimCybos charged for every BlockRequest
+    :param latency: seconds one BlockRequest takes on the status clock
+    """
+
+    def __init__(self, last_date=20200228, days=1000, block_size=2000, status=None, latency=0.0):
+        self.last_date = last_date
+        self.days = days
+        self.block_size = block_size
+        self.status = status
+        self.latency = latency
+        self.slots = [(9 * 60 + s) // 60 * 100 + (9 * 60 + s) % 60 for s in range(390, 0, -1)]
+        self.calendar = []
+        self._days = _trading_days(last_date)
+        self.inputs = {}
+        self.requests = 0
+        self.Continue = 0
+        self._fresh = True
+        self._cursor = 0
+        self._length = 0
+        self._stop = 0
+
+    def _date(self, day):
+        while len(self.calendar) <= day:
+            self.calendar.append(next(self._days))
+        return self.calendar[day]
+
+    def _seed(self):
+        return zlib.crc32(str(self.inputs.get(0, "")).encode())
+
+    def _per_day(self):
+        return 1 if chr(self.inputs.get(6, ord("D"))) in "DWM" else len(self.slots)
+
+    def _history(self):
+        return (self.days - self._seed() % (self.days // 2)) * self._per_day()
+
+    def _first_bar(self, date):
+        day = 0
+        while day < self.days and self._date(day) > date:
+            day += 1
+        return day * self._per_day()
+
+    def _value(self, field, k):
+        per_day = self._per_day()
+        seed = self._seed()
+        price = 1000 + seed % 90000 + (k * 7919 + seed) % 200 - 100
+        if field == 0:
+            return self._date(k // per_day)
+        elif field == 1:
+            return self.slots[k % per_day] if per_day > 1 else 1530
+        elif field == 2:
+            return price
+        elif field == 3:
+            return price + 5
+        elif field == 4:
+            return price - 5
+        elif field == 5:
+            return price + k % 3 - 1
+        elif field == 8:
+            return (k * 31 + seed) % 10000 + 1
+        elif field == 12:
+            return 10000000 + seed % 1000
+        elif field == 13:
+            return price * (10000000 + seed % 1000)
+        return (seed + field * k) % 5000 / 100.0
+
+    def SetInputValue(self, index, value):
+        self.inputs[index] = value
+        self._fresh = True
+
+    def BlockRequest(self):
+        self.requests += 1
+        if self.status is not None:
+            self.status.consume()
+            self.status.clock.sleep(self.latency)
+        if self._fresh:
+            history = self._history()
+            if self.inputs.get(1) == ord("1"):
+                self._cursor = self._first_bar(self.inputs.get(2, self.last_date))
+                self._stop = min(self._first_bar(self.inputs.get(3, 0) - 1), history)
+            else:
+                self._cursor = 0
+                self._stop = min(self.inputs.get(4, history), history)
+            self._fresh = False
+        else:
+            self._cursor += self._length
+        self._length = max(0, min(self.block_size, self._stop - self._cursor))
+        self.Continue = 1 if self._cursor + self._length < self._stop else 0
+
+    def GetHeaderValue(self, index):
+        if index == 3:
+            return self._length
+        return 0
+
+    def GetDataValue(self, column, index):
+        return self._value(self.inputs[5][column], self._cursor + index)
+
+    def GetDibStatus(self):
+        return 0
+
+    def GetDibMsg1(self):
+        return ""
+
+
+class SimCodeMgr:
+    """
+    In-process stand-in for CpUtil.CpCodeMgr over a synthetic universe.
+    Every tenth stock is not a corporation (section kind 10, like ETFs).
+    """
+
+    def __init__(self, stocks=(30, 30)):
+        self.markets = {market: ["A{:06d}".format(market * 100000 + i * 10) for i in range(count)]
+                        for market, count in enumerate(stocks, 1)}
+
+    def GetStockListByMarket(self, market):
+        return tuple(self.markets.get(market, []))
+
+    def CodeToName(self, code):
+        return "SIM{}".format(code[1:])
+
+    def GetStockMemeMin(self, code):
+        return 1
+
+    def GetStockMarketKind(self, code):
+        return int(code[1])
+
+    def GetStockSectionKind(self, code):
+        return 10 if int(code[1:]) // 10 % 10 == 9 else 1
+
+    def GetStockListedDate(self, code):
+        return 19900101 + zlib.crc32(code.encode()) % 30 * 10000
+
+
+def dispatch(name, status=None):
+    """stand-in for win32com.client.Dispatch, charging chart requests to status"""
+    if name == "CpSysDib.StockChart":
+        return SimStockChart(status=status)
+    elif name == "CpUtil.CpCodeMgr":
+        return SimCodeMgr()
+    raise ValueError("no stand-in for {}".format(name))
+
+
+# report kinds of the synthetic DART filings, by listed title
+DART_TITLES = [
+    "단일판매ㆍ공급계약체결",
+    "[기재정정]단일판매ㆍ공급계약체결",
+    "주요사항보고서(유상증자결정)",
+    "주요사항보고서(자기주식취득결정)",
+    "주요사항보고서(전환사채권발행결정)",
+    "임원ㆍ주요주주특정증권등소유상황보고서",
+    "주식등의대량보유상황보고서(일반)",
+    "기업설명회(IR)개최(안내공시)",
+]
+
+
+def _amount(rand, low=10 ** 8, high=10 ** 11):
+    return "{:,}".format(rand.randrange(low, high))
+
+
+def _cell(text, cls="xforms_input", span=1):
+    span = ' colspan="{}"'.format(span) if span > 1 else ""
+    return '<td class="xforms_title"{}><span class="{}" style="width:100%;">{}</span></td>'.format(
+        span, cls, text)
+
+
+def _table(rows):
+    lines = ['<table class="nb" border="1" cellspacing="0" cellpadding="0">', "<tbody>"]
+    for cells in rows:
+        lines.append("<tr>" + "".join(_cell(text) for text in cells) + "</tr>")
+    lines += ["</tbody>", "</table>"]
+    return "\n".join(lines)
+
+
+def _document_rows(title, rand):
+    """key rows of a viewer document in the layout of the DART report forms"""
+    if "단일판매" in title:
+        return [
+            ["1. 판매ㆍ공급계약 내용", "제품 공급 계약"],
+            ["2. 계약내역", "계약금액(원)", _amount(rand)],
+            ["", "최근매출액(원)", _amount(rand)],
+            ["", "매출액대비(%)", "{:.2f}".format(rand.uniform(1, 90))],
+            ["", "대규모법인여부", rand.choice(["해당", "미해당"])],
+            ["3. 계약상대", "&nbsp;", "SIM 주식회사"],
+        ]
+    if "유상증자" in title:
+        return [
+            ["1. 신주의 종류와 수", "보통주식 (주)", _amount(rand, 10 ** 5, 10 ** 7)],
+            ["2. 1주당 액면가액 (원)", "500"],
+            ["4. 자금조달의 목적", "시설자금 (원)", rand.choice(["-", _amount(rand)])],
+            ["", "운영자금 (원)", _amount(rand)],
+            ["", "타법인 증권 취득자금 (원)", "-"],
+            ["", "기타자금 (원)", rand.choice(["-", _amount(rand)])],
+        ]
+    if "자기주식취득" in title:
+        return [
+            ["1. 취득예정주식(주)", "보통주식", _amount(rand, 10 ** 4, 10 ** 6)],
+            ["2. 취득예정금액(원)", "보통주식", _amount(rand)],
+            ["3. 취득예상기간", "시작일", "2020년 03월 02일"],
+        ]
+    if "전환사채" in title:
+        return [
+            ["1. 사채의 종류", "회차", str(rand.randrange(1, 20)), "종류", "무기명식 이권부 무보증 사모 전환사채"],
+            ["2. 사채의 권면총액 (원)", _amount(rand)],
+            ["4. 자금조달의 목적", "시설자금 (원)", "-"],
+            ["", "운영자금 (원)", _amount(rand)],
+            ["", "타법인 증권 취득자금 (원)", "-"],
+            ["", "기타자금 (원)", "-"],
+            ["5. 사채의 이율", "표면이자율 (%)", "{:.1f}".format(rand.uniform(0, 3))],
+            ["", "만기이자율 (%)", "{:.1f}".format(rand.uniform(0, 6))],
+            ["6. 사채만기일", "2023년 03월 02일"],
+            ["9. 전환에 관한 사항", "전환에 따라 발행할 주식", "주식수", _amount(rand, 10 ** 5, 10 ** 7)],
+            ["", "", "주식총수대비 비율(%)", "{:.2f}".format(rand.uniform(1, 30))],
+            ["11. 사채발행방법", "사모"],
+        ]
+    return [["1. 보고 내용", "기타 공시"], ["2. 보고일", "2020년 03월 02일"]]
+
+
+class _SimDARTServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _SimDARTHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        status, body, headers = self.server.sim.answer(self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SimDART:
+    """
+    Local HTTP stand-in for dart.fss.or.kr.
+
+    Serves deterministic listing, filing and viewer pages in the markup of
+    recorded DART pages for any date, so the crawlers can be run and measured
+    without the real server. Use as a context manager and pass `root` as the
+    DART root url.
+    :param filings: filings listed per weekday, newest first
+    :param latency: seconds each answer is delayed
+    :param limit: requests per second above which it answers 429, None for no limit
+    :param error_rate: share of requests answered with 503
+    :param padding: filler tables per viewer document, real filings are mostly boilerplate
+    """
+
+    def __init__(self, filings=120, latency=0.0, limit=None, error_rate=0.0, padding=20, seed=0):
+        self.filings = filings
+        self.latency = latency
+        self.limit = limit
+        self.error_rate = error_rate
+        self.padding = padding
+        self.rand = random.Random(seed)
+        self.requests = 0
+        self.rejected = 0
+        self.paths = {
+            "/dsac001/mainAll.do": self.listing,
+            "/dsaf001/main.do": self.filing,
+            "/report/viewer.do": self.viewer,
+        }
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self.server = None
+
+    def __enter__(self):
+        self.server = _SimDARTServer(("127.0.0.1", 0), _SimDARTHandler)
+        self.server.sim = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def root(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def _admit(self):
+        """status of the quota and error injection, 200 if the request is served"""
+        with self._lock:
+            self.requests += 1
+            now = time.time()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if self.limit is not None and len(self._recent) >= self.limit:
+                self.rejected += 1
+                return 429
+            self._recent.append(now)
+            if self.rand.random() < self.error_rate:
+                self.rejected += 1
+                return 503
+        return 200
+
+    def answer(self, path):
+        """:return: (status, body, headers) of a GET of path"""
+        if self.latency:
+            time.sleep(self.latency)
+        status = self._admit()
+        if status == 429:
+            return status, b"", {"Retry-After": "1"}
+        if status != 200:
+            return status, b"", {}
+        url = urlsplit(path)
+        page = self.paths.get(url.path)
+        if page is None:
+            return 404, b"", {}
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        return 200, page(params).encode("utf-8"), {}
+
+    def title(self, rcp_no):
+        return DART_TITLES[zlib.crc32(rcp_no.encode()) % len(DART_TITLES)]
+
+    def rcp_nos(self, date):
+        """rcpNo of the filings of a yyyymmdd date, newest first"""
+        day = datetime.date(int(date[:4]), int(date[4:6]), int(date[6:]))
+        if day.weekday() >= 5:
+            return []
+        return ["{}80{:04d}".format(date, seq) for seq in range(self.filings, 0, -1)]
+
+    def listing(self, params):
+        date = params.get("selectDate", "")
+        size = int(params.get("maxResults", 100))
+        page = int(params.get("currentPage", 1))
+        rcp_nos = self.rcp_nos(date)[(page - 1) * size:page * size]
+        rows = []
+        for rcp_no in rcp_nos:
+            seq = int(rcp_no[-4:])
+            minute = 7 * 60 + seq * 11 * 60 // max(self.filings, 1)
+            company = "{:08d}".format(zlib.crc32(rcp_no.encode()) % 10 ** 6)
+            rows.append("""<tr>
+\t<td class="cen_txt">{:02d}:{:02d}</td>
+\t<td><span class="nobr1"><img src="/images/ico_kospi.gif" alt="유가증권시장">
+\t\t<a href="/dsae001/selectPopup.ax?selectKey={}" title="기업개황 새창">SIM{}</a></span></td>
+\t<td><a href="/dsaf001/main.do?rcpNo={}" id="r_{}" title="{} 공시뷰어 새창">
+\t\t\t{}
+\t\t</a></td>
+\t<td class="cen_txt">SIM{}</td>
+\t<td class="cen_txt">{}.{}.{}</td>
+\t<td class="cen_txt"><img src="/images/ico_yu.gif" alt="유"></td>
+</tr>""".format(minute // 60, minute % 60, company, company[-4:], rcp_no, rcp_no,
+                self.title(rcp_no), self.title(rcp_no), company[-4:], date[:4], date[4:6], date[6:]))
+        if not rows:
+            rows.append('<tr><td colspan="6" class="no_data">조회 결과가 없습니다.</td></tr>')
+        return """<html><head><meta charset="utf-8"><title>전자공시시스템 DART</title></head>
+<body><div class="table_list"><table>
+<thead><tr><th>시간</th><th>공시대상회사</th><th>보고서명</th><th>제출인</th><th>접수일자</th><th>비고</th></tr></thead>
+<tbody>
+{}
+</tbody></table></div></body></html>""".format("\n".join(rows))
+
+    def filing(self, params):
+        rcp_no = params.get("rcpNo", "")
+        dcm_no = str(zlib.crc32(rcp_no.encode()) % 10 ** 7)
+        return """<html><head><meta charset="utf-8"><title>{}</title>
+<script type="text/javascript">
+\tfunction viewDoc(rcpNo, dcmNo, eleId, offset, length, dtd) {{
+\t\tdocument.getElementById("ifrm").src = "/report/viewer.do?rcpNo=" + rcpNo;
+\t}}
+\t$(document).ready(function() {{
+\t\tviewDoc('{}', '{}', null, null, null, 'dart3.xsd');
+\t}});
+</script></head>
+<body><iframe id="ifrm" src=""></iframe></body></html>""".format(self.title(rcp_no), rcp_no, dcm_no)
+
+    def viewer(self, params):
+        rcp_no = params.get("rcpNo", "")
+        title = self.title(rcp_no)
+        rand = random.Random(rcp_no)
+        padding = [_table([["{}. 기타 투자판단에 참고할 사항".format(i), "&nbsp;",
+                            "- 상기 내용은 {} 기준입니다. (단위 : 원)".format(rcp_no[:8])]
+                           for i in range(12, 20)]) for _ in range(self.padding)]
+        cover = """<table class="nb"><tbody>
+<tr><td class="xforms_title">회 사 명 :<br/>대표이사 :</td><td><table><tbody>
+<tr><td>SIM{} 주식회사</td></tr>
+<tr><td>홍 길 동&nbsp;<!-- signed --></td></tr>
+</tbody></table></td></tr>
+<tr><td rowspan="2">본 점 소 재 지 :</td><td>서울특별시 영등포구 여의대로 &amp; 1</td></tr>
+<tr><td>(전 화) 02-0000-0000</td></tr>
+</tbody></table>""".format(rcp_no[-4:])
+        return """<html><head><meta charset="utf-8"><title>{}</title>
+<link rel="stylesheet" href="/css/report_xml.css" type="text/css">
+</head><body>
+<!-- {} -->
+<p class="section-2">{}</p>
+{}
+{}
+{}
+</body></html>""".format(title, rcp_no, title, cover, _table(_document_rows(title, rand)),
+                         "\n".join(padding))
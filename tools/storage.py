@@ -0,0 +1,211 @@
+import os
+import numpy as np
+
+
+# h5py create_dataset filters of each named layout, datasets stay chunked
+# so they can be resized by append_columns
+LAYOUTS = {
+    "plain": dict(),
+    "lzf": dict(compression="lzf"),
+    "shuffle-lzf": dict(shuffle=True, compression="lzf"),
+    "gzip": dict(compression="gzip", compression_opts=4),
+    "shuffle-gzip": dict(shuffle=True, compression="gzip", compression_opts=4),
+}
+DEFAULT_LAYOUT = "shuffle-gzip"
+
+
+def layout_options(layout=DEFAULT_LAYOUT, chunk_rows=None):
+    """
+    create_dataset options of a layout
+    :param layout: name in LAYOUTS, or "contiguous" for fixed-size datasets
+        that can be memory-mapped but not appended to
+    :param chunk_rows: rows per chunk, h5py guesses from the first write if omitted
+    """
+    if layout == "contiguous":
+        return {}
+    if layout not in LAYOUTS:
+        raise ValueError("unknown layout {}, one of {}".format(layout, sorted(LAYOUTS)))
+    options = dict(LAYOUTS[layout], maxshape=(None,))
+    options["chunks"] = (chunk_rows,) if chunk_rows else True
+    return options
+
+
+def open_layout(status):
+    """layout options of status, opt.layout and opt.chunk_rows override the defaults"""
+    return layout_options(status.opt.get("layout") or DEFAULT_LAYOUT, status.opt.get("chunk_rows"))
+
+
+def create_columns(group, record, options=None):
+    """
+    write each column of record as a resizable dataset of group
+    :param options: create_dataset options, see layout_options
+    """
+    options = options or layout_options()
+    for name, values in record.items():
+        group.create_dataset(name, data=values, **options)
+
+
+def resizable(group, name, options):
+    """dataset name of group, rewritten as resizable if an older version wrote it fixed-size"""
+    dataset = group[name]
+    if dataset.maxshape[0] is not None:
+        stored = dataset[...]
+        del group[name]
+        dataset = group.create_dataset(name, data=stored, **options)
+    return dataset
+
+
+def append_columns(group, record, options=None):
+    """
+    append record to the datasets of group in place
+    fixed-size datasets written by older versions are made resizable first
+    """
+    options = options or layout_options()
+    for name, values in record.items():
+        if name not in group:
+            group.create_dataset(name, data=values, **options)
+            continue
+        dataset = resizable(group, name, options)
+        size = dataset.shape[0]
+        dataset.resize((size + len(values),))
+        dataset[size:] = values
+
+
+def trim_columns(group):
+    """cut the datasets of group to a common length after an interrupted append"""
+    if not len(group):
+        return
+    if "stream_base" in group.attrs:
+        # rows reserved by an interrupted ColumnStream
+        length = group.attrs["stream_base"]
+        del group.attrs["stream_base"]
+    else:
+        length = min(dataset.shape[0] for dataset in group.values())
+    for dataset in group.values():
+        if dataset.shape[0] > length:
+            dataset.resize((length,))
+
+
+def drop_last(group, options=None):
+    """
+    cut the newest row of every dataset of group
+    fixed-size datasets written by older versions are made resizable first
+    """
+    options = options or layout_options()
+    for name in list(group):
+        dataset = resizable(group, name, options)
+        if dataset.shape[0]:
+            dataset.resize((dataset.shape[0] - 1,))
+
+
+def last_row(group, names):
+    """
+    newest stored values of names as a tuple
+    :return: None if any column is missing or empty
+    """
+    row = []
+    for name in names:
+        if name not in group or group[name].shape[0] == 0:
+            return None
+        row.append(group[name][-1].item())
+    return tuple(row)
+
+
+class ColumnStream:
+    """
+    Write StockChart blocks to the datasets of group as they arrive.
+
+    Blocks come newest first, so rows are reserved behind the stored ones and
+    each block is written in front of the previous one, filling the reserved
+    rows from the tail. finish() moves the filled rows down onto the stored
+    ones and drops the rest. Until then attrs["stream_base"] holds the stored
+    length, which trim_columns restores after an interrupted stream.
+    :param columns: (field, name, dtype) column spec, see chart.MINUTE_COLUMNS
+    :param options: create_dataset options, see layout_options
+    :param reserve: rows reserved at first, doubled while the stock grows
+    :param step: rows per copy when filled rows are moved
+    """
+
+    def __init__(self, group, columns, options=None, reserve=4096, step=65536):
+        options = dict(options or layout_options())
+        if options.get("chunks") is True:
+            options["chunks"] = (reserve,)
+        self.group = group
+        self.names = [name for _, name, _ in columns]
+        self.reserve = reserve
+        self.step = step
+        for _, name, dtype in columns:
+            if name in group:
+                resizable(group, name, options)
+            else:
+                group.create_dataset(name, shape=(0,), dtype=dtype, **options)
+        trim_columns(group)
+        self.base = group[self.names[0]].shape[0]
+        self.head = self.end = self.base
+        group.attrs["stream_base"] = self.base
+
+    def __len__(self):
+        return self.end - self.head
+
+    def _resize(self, length):
+        for name in self.names:
+            self.group[name].resize((length,))
+
+    def _move(self, src, dst, count):
+        """copy rows [src, src + count) to dst, a step at a time"""
+        starts = range(0, count, self.step)
+        if dst > src:
+            starts = reversed(starts)
+        for start in starts:
+            end = min(start + self.step, count)
+            for name in self.names:
+                dataset = self.group[name]
+                dataset[dst + start:dst + end] = dataset[src + start:src + end]
+
+    def _reserve(self, count):
+        if self.head - count >= self.base:
+            return
+        extra = max(count, len(self), self.reserve)
+        self._resize(self.end + extra)
+        self._move(self.head, self.head + extra, len(self))
+        self.head += extra
+        self.end += extra
+
+    def write(self, block):
+        """
+        :param block: {name: values} in chronological order, older than every row written so far
+        """
+        count = len(block[self.names[0]])
+        if not count:
+            return
+        self._reserve(count)
+        for name in self.names:
+            self.group[name][self.head - count:self.head] = block[name]
+        self.head -= count
+
+    def finish(self):
+        """:return: number of rows written"""
+        rows = len(self)
+        self._move(self.head, self.base, rows)
+        self._resize(self.base + rows)
+        del self.group.attrs["stream_base"]
+        return rows
+
+
+def staging_path(path, resume=False):
+    """
+    file to write a full rebuild to instead of path, moved over it by
+    commit_staging. An interrupted run leaves it behind to be continued
+    with resume. Incremental runs append to path in place, trim_columns
+    and the checkpoint journal recover them instead
+    """
+    part = path + ".part"
+    if resume and os.path.exists(part):
+        return part
+    if os.path.exists(part):
+        os.remove(part)
+    return part
+
+
+def commit_staging(path):
+    os.replace(path + ".part", path)
@@ -0,0 +1,135 @@
+import h5py
+import numpy as np
+
+from table import TABLE_FORMAT
+
+
+def mmap_dataset(dataset):
+    """
+    read-only np.memmap over a dataset
+    :return: None unless the dataset is contiguous and unfiltered
+    """
+    if dataset.chunks is not None or dataset.compression or not dataset.shape[0]:
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dataset.file.filename, mode="r", dtype=dataset.dtype,
+                     shape=dataset.shape, offset=offset)
+
+
+def bisect(column, value, lo, hi, side="left"):
+    """
+    np.searchsorted on column[lo:hi] returned as an index of column.
+    HDF5 datasets are probed one element at a time, so only O(log n) chunks
+    are read instead of the whole column
+    """
+    if isinstance(column, np.ndarray):
+        return lo + int(np.searchsorted(column[lo:hi], value, side=side))
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if column[mid] < value or (side == "right" and column[mid] == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class BarStore:
+    """
+    Read API over bar files, the one group per stock files written by the
+    crawlers as well as tables packed by pack_table.
+
+    Columns are np.memmap views where the datasets are contiguous, e.g.
+    pack --layout=contiguous, and HDF5 datasets otherwise. Date ranges are
+    found by binary search on the sorted dates, and only the rows inside are
+    read.
+    """
+
+    def __init__(self, path):
+        self.file = h5py.File(path, "r")
+        self.table = self.file.attrs.get("format") == TABLE_FORMAT
+        if self.table:
+            self.codes = [code.decode() for code in self.file["codes"][...]]
+            self.offsets = self.file["offsets"][...]
+            self.index = {code: i for i, code in enumerate(self.codes)}
+            self.columns = {name: self._open(dataset)
+                            for name, dataset in self.file["columns"].items()}
+        else:
+            self.codes = list(self.file.keys())
+
+    def _open(self, dataset):
+        mapped = mmap_dataset(dataset)
+        return dataset if mapped is None else mapped
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, code):
+        return code in (self.index if self.table else self.file)
+
+    def keys(self):
+        return list(self.codes)
+
+    def column(self, name):
+        """
+        whole packed column with /offsets, rows of the i-th code are
+        column[offsets[i]:offsets[i + 1]]
+        :return: (np.memmap or HDF5 dataset, offsets)
+        """
+        if not self.table:
+            raise ValueError("{} is not a packed table".format(self.file.filename))
+        return self.columns[name], self.offsets
+
+    def _columns(self, code):
+        """{name: column}, rows of code in the columns"""
+        if self.table:
+            i = self.index[code]
+            return self.columns, self.offsets[i], self.offsets[i + 1]
+        group = self.file[code]
+        columns = {name: self._open(dataset) for name, dataset in group.items()}
+        return columns, 0, min(column.shape[0] for column in columns.values())
+
+    def _read(self, columns, start, end):
+        return {name: column[start:end] for name, column in columns.items()}
+
+    def __getitem__(self, code):
+        """{name: values} of every row of code"""
+        columns, start, end = self._columns(code)
+        return self._read(columns, start, end)
+
+    def _date_rows(self, columns, start, end, from_date, to_date):
+        dates = columns["dates"]
+        lo = start if from_date is None else bisect(dates, from_date, start, end)
+        hi = end if to_date is None else bisect(dates, to_date, lo, end, side="right")
+        return lo, hi
+
+    def range(self, code, from_date=None, to_date=None):
+        """{name: values} of code dated in [from_date, to_date]"""
+        columns, start, end = self._columns(code)
+        return self._read(columns, *self._date_rows(columns, start, end, from_date, to_date))
+
+
+class DateStore(BarStore):
+    """BarStore of daily bars, date_data.h5"""
+
+
+class MinuteStore(BarStore):
+    """BarStore of minute bars, minute_data.h5 and ninetoten.h5"""
+
+    def window(self, code, date, from_minute=None, to_minute=None):
+        """{name: values} of code on date with minutes in [from_minute, to_minute]"""
+        columns, start, end = self._columns(code)
+        lo, hi = self._date_rows(columns, start, end, date, date)
+        minutes = columns["minutes"]
+        if from_minute is not None:
+            lo = bisect(minutes, from_minute, lo, hi)
+        if to_minute is not None:
+            hi = bisect(minutes, to_minute, lo, hi, side="right")
+        return self._read(columns, lo, hi)
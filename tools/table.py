@@ -0,0 +1,51 @@
+import h5py
+import numpy as np
+
+from storage import layout_options
+
+
+TABLE_FORMAT = "csr-1"
+
+
+def pack_table(src, dst, options=None):
+    """
+    pack a file of one group per stock into a single table.
+
+    /codes        sorted stock codes
+    /offsets      rows of codes[i] are offsets[i]:offsets[i + 1]
+    /columns/<n>  every stock's rows concatenated in code order,
+                  sorted by (date, minute) within a stock
+    :param src: HDF5 file written by Minute.run, DateData.run or NinetoTen.save
+    :param dst: table file to write
+    :param options: create_dataset options of the columns, see layout_options,
+        layout_options("contiguous") lets readers memory-map the columns
+    :return: number of packed stocks
+    """
+    if options is None:
+        options = layout_options()
+    options = {key: value for key, value in options.items() if key != "maxshape"}
+    with h5py.File(src, "r") as fin, h5py.File(dst, "w") as fout:
+        codes = sorted(code for code in fin.keys() if len(fin[code]))
+        names = sorted(set.intersection(*[set(fin[code].keys()) for code in codes])) if codes else []
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        for i, code in enumerate(codes):
+            offsets[i + 1] = offsets[i] + min(fin[code][name].shape[0] for name in names)
+        columns = fout.create_group("columns")
+        for name in names:
+            dtype = fin[codes[0]][name].dtype
+            if offsets[-1]:
+                columns.create_dataset(name, shape=(offsets[-1],), dtype=dtype, **options)
+            else:
+                columns.create_dataset(name, shape=(0,), dtype=dtype)
+        for i, code in enumerate(codes):
+            group = fin[code]
+            start, end = offsets[i], offsets[i + 1]
+            keys = [group[name][:end - start] for name in ["minutes", "dates"] if name in names]
+            order = np.lexsort(keys) if keys else np.arange(end - start)
+            for name in names:
+                columns[name][start:end] = group[name][:end - start][order]
+        fout.create_dataset("codes", data=np.array(codes, dtype="S"))
+        fout.create_dataset("offsets", data=offsets)
+        fout.attrs["format"] = TABLE_FORMAT
+    return len(codes)
+
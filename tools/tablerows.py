@@ -0,0 +1,89 @@
+import re
+from bs4 import BeautifulSoup
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    # lxml is optional, BeautifulSoup reads the same rows slower
+    # once the omitted end tags are closed like libxml2 does
+    lxml = None
+
+
+BACKENDS = ("lxml", "bs4")
+DEFAULT_BACKEND = "lxml" if lxml is not None else "bs4"
+
+_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+_parsers = {}
+
+
+def _charset(content):
+    match = _CHARSET.search(content[:4096])
+    return match.group(1).decode("ascii").lower() if match else "utf-8"
+
+
+def lxml_rows(content):
+    """
+    rows of td text through lxml, the tree is built in C and every cell is
+    read once. The charset comes from the meta tag like BeautifulSoup finds it
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+        encoding = "utf-8"
+    else:
+        encoding = _charset(content)
+    parser = _parsers.get(encoding)
+    if parser is None:
+        parser = _parsers[encoding] = lxml.html.HTMLParser(encoding=encoding)
+    try:
+        root = lxml.html.document_fromstring(content, parser=parser)
+    except (lxml.etree.ParserError, ValueError):
+        return
+    for tr in root.iter("tr"):
+        yield [td.text_content().strip() for td in tr.iter("td")]
+
+
+def _close_omitted(soup):
+    """
+    html.parser nests a <td> or <tr> whose end tag was left out into the
+    previous cell, lxml closes it instead. Move every such tag, and what
+    follows it, behind the cell or row it should have closed
+    """
+    for tag in soup.find_all(["tr", "td", "th"]):
+        anchor = None
+        for parent in tag.parents:
+            if parent.name == "table" or (tag.name != "tr" and parent.name == "tr"):
+                break
+            if parent.name == tag.name or (tag.name != "tr" and parent.name in ("td", "th")):
+                anchor = parent
+        if anchor is None:
+            continue
+        for node in reversed([tag] + list(tag.next_siblings)):
+            anchor.insert_after(node.extract())
+
+
+def bs4_rows(content):
+    """
+    rows of td text through BeautifulSoup and html.parser, omitted </td>
+    and </tr> are closed first so viewer documents give the lxml rows
+    """
+    soup = BeautifulSoup(content, "html.parser")
+    _close_omitted(soup)
+    for tr in soup.find_all("tr"):
+        yield [td.text.strip() for td in tr.find_all("td")]
+
+
+def table_rows(content, backend=None):
+    """
+    text of the td cells of every tr in document order, stripped, empty
+    cells included. Cells of nested tables also count for the outer rows,
+    as find_all does
+    :param backend: "lxml" or "bs4", None for lxml when installed
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == "lxml":
+        if lxml is None:
+            raise ValueError("lxml is not installed, use the bs4 backend")
+        return list(lxml_rows(content))
+    elif backend == "bs4":
+        return list(bs4_rows(content))
+    raise ValueError("unknown backend {}, one of {}".format(backend, BACKENDS))
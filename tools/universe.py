@@ -0,0 +1,203 @@
+import os
+import time
+import json
+import datetime
+from os.path import join as pjoin
+
+from misc import get_logger
+
+
+STOCK_META = pjoin("res", "stock_meta.json")
+STOCK_META_HISTORY = pjoin("res", "stock_meta_history.jsonl")
+
+
+def query_meta(code_mgr, stock):
+    return dict(
+        name=code_mgr.CodeToName(stock),
+        mememin=code_mgr.GetStockMemeMin(stock),
+        marketkind=code_mgr.GetStockMarketKind(stock),
+        sectionkind=code_mgr.GetStockSectionKind(stock),
+        listeddate=code_mgr.GetStockListedDate(stock),
+    )
+
+
+def diff_meta(code_mgr, previous, markets=(1, 2), date=None, fields=False):
+    """
+    StockMeta info refreshed against the previous snapshot.
+
+    New codes and codes that moved to another market are queried in full,
+    five calls each. Other known codes cost no call beyond the market lists.
+    :param fields: query again the fields that change in place, name, trading
+        unit and section kind, three calls per known stock
+    :return: info, events to append to the listing history
+    """
+    date = date or int(datetime.date.today().strftime("%Y%m%d"))
+    info, events = {}, []
+    for market in markets:
+        for stock in code_mgr.GetStockListByMarket(market):
+            meta = previous.get(stock)
+            if meta is None:
+                info[stock] = query_meta(code_mgr, stock)
+                # the first snapshot dates listings by their listed date
+                listed = info[stock]["listeddate"] if not previous else date
+                events.append(dict(date=listed, code=stock, event="listed", meta=info[stock]))
+                continue
+            if meta["marketkind"] != market:
+                info[stock] = query_meta(code_mgr, stock)
+            elif fields:
+                info[stock] = dict(meta, name=code_mgr.CodeToName(stock),
+                                   mememin=code_mgr.GetStockMemeMin(stock),
+                                   sectionkind=code_mgr.GetStockSectionKind(stock))
+            else:
+                info[stock] = meta
+                continue
+            changes = sorted(key for key in info[stock] if info[stock][key] != meta.get(key))
+            if changes:
+                events.append(dict(date=date, code=stock, event="changed", changes=changes,
+                                   meta=info[stock]))
+    for stock in previous:
+        if stock not in info:
+            events.append(dict(date=date, code=stock, event="delisted"))
+    return info, events
+
+
+def read_history(path=STOCK_META_HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+
+def append_history(events, path=STOCK_META_HISTORY):
+    with open(path, "a", newline='') as fout:
+        for event in events:
+            fout.write(json.dumps(event) + "\n")
+        fout.flush()
+        os.fsync(fout.fileno())
+
+
+def meta_as_of(events, date):
+    """replay listing history up to date into StockMeta info"""
+    info = {}
+    for event in sorted(events, key=lambda event: event["date"]):
+        if event["date"] > date:
+            break
+        if event["event"] == "delisted":
+            info.pop(event["code"], None)
+        else:
+            info[event["code"]] = event["meta"]
+    return info
+
+
+def open_universe(status, code_mgr, path=STOCK_META):
+    """
+    universe refreshed through code_mgr, opt.stock_meta overrides the path,
+    opt.universe_ttl the max age in seconds and opt.universe_fields_ttl the
+    max age of the fields that change in place
+    """
+    path = status.opt.get("stock_meta", path)
+    ttl = status.opt.get("universe_ttl", Universe.TTL)
+    fields_ttl = status.opt.get("universe_fields_ttl", Universe.FIELDS_TTL)
+    return Universe(lambda previous, fields: diff_meta(code_mgr, previous, fields=fields),
+                    path=path, ttl=ttl, fields_ttl=fields_ttl)
+
+
+class Universe:
+    """
+    Stock universe served from the StockMeta snapshot.
+
+    The snapshot is refreshed through `refresh` only when it is missing or older
+    than `ttl` seconds, so a crawler starts from one file read instead of a
+    CpCodeMgr call per stock. Every refresh appends its listings, delistings
+    and attribute changes to the history next to the snapshot.
+    A refresh only queries new codes, the fields that change in place are
+    queried for every stock once they are older than `fields_ttl`, their age
+    is the mtime of <path>.fields.
+    :param refresh: refresh(previous info, fields) -> info, events, see diff_meta
+    :param path: json snapshot, the file StockMeta.run writes
+    :param ttl: max age of the snapshot in seconds
+    :param fields_ttl: max age of the fields that change in place in seconds
+    """
+    TTL = 24 * 60 * 60
+    FIELDS_TTL = 7 * 24 * 60 * 60
+
+    def __init__(self, refresh, path=STOCK_META, ttl=TTL, fields_ttl=FIELDS_TTL):
+        self.refresh = refresh
+        self.path = path
+        self.history = pjoin(os.path.dirname(path), os.path.basename(STOCK_META_HISTORY))
+        self.fields = path + ".fields"
+        self.ttl = ttl
+        self.fields_ttl = fields_ttl
+        self.info = None
+        self.logger = get_logger()
+
+    def _age(self, path):
+        if not os.path.exists(path):
+            return None
+        return time.time() - os.path.getmtime(path)
+
+    def is_stale(self):
+        age = self._age(self.path)
+        return age is None or age > self.ttl
+
+    def fields_stale(self):
+        age = self._age(self.fields)
+        return age is None or age > self.fields_ttl
+
+    def load(self):
+        if self.info is not None:
+            return self.info
+        if self.is_stale():
+            previous = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r") as fin:
+                    previous = json.load(fin)
+            if previous and not os.path.exists(self.history):
+                # a snapshot written before the history existed seeds it
+                append_history([dict(date=meta["listeddate"], code=code, event="listed", meta=meta)
+                                for code, meta in previous.items()], self.history)
+            fields = self.fields_stale()
+            self.info, events = self.refresh(previous, fields)
+            append_history(events, self.history)
+            self.logger.info("refresh stock meta : {}, {} stocks, {} events".format(
+                self.path, len(self.info), len(events)))
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", newline='') as fout:
+                json.dump(self.info, fout)
+            os.replace(tmp, self.path)
+            if fields:
+                with open(self.fields, "w") as fout:
+                    fout.write(datetime.date.today().strftime("%Y%m%d"))
+        else:
+            with open(self.path, "r") as fin:
+                self.info = json.load(fin)
+        return self.info
+
+    def as_of(self, date):
+        """StockMeta info of the universe on date, replayed from the history"""
+        self.load()
+        return meta_as_of(read_history(self.history), date)
+
+    def codes(self, markets=(1, 2), sections=None, listed_before=None, date=None):
+        """
+        stock codes in snapshot order, kospi before kosdaq
+        :param markets: marketkind values to keep, 1 kospi, 2 kosdaq
+        :param sections: sectionkind values to keep, (1,) for corporations only
+        :param listed_before: keep stocks listed on or before this date
+        :param date: universe as of this date instead of the latest snapshot
+        """
+        info = self.load() if date is None else self.as_of(date)
+        codes = []
+        for code, meta in info.items():
+            if meta["marketkind"] not in markets:
+                continue
+            if sections is not None and meta["sectionkind"] not in sections:
+                continue
+            if listed_before is not None and meta["listeddate"] > listed_before:
+                continue
+            codes.append(code)
+        return codes
+
+    def names(self, codes=None):
+        info = self.load()
+        return {code: info[code]["name"] for code in (codes if codes is not None else info)}
@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import threading
+from os.path import join as pjoin
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+from requests.adapters import HTTPAdapter
+
+from misc import get_logger
+
+
+# answers worth another try after backing off, None is a connection error
+RETRY_STATUS = (None, 429, 500, 502, 503, 504)
+
+HTTP_CACHE = pjoin("res", "http_cache")
+
+
+def open_session(pool_size=4):
+    """session keeping up to pool_size connections per host alive"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def retry_after(response):
+    """seconds of a Retry-After header, None if missing or a date"""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveThrottle:
+    """
+    Pace HTTP requests of several threads against one server.
+
+    Request starts are spaced `interval` apart. The interval grows by
+    `backoff` on 429/5xx answers and connection errors, which also hold every
+    request back for the Retry-After the server asked for. It grows gently
+    while responses are slower than `target_latency` and shrinks back while
+    the server answers fast, down to `floor`, a bit above the interval that
+    last drew an error. The floor itself slowly sinks back to `min_interval`
+    so a server that got faster is probed again.
+    :param min_interval: smallest spacing between request starts in seconds
+    :param max_interval: largest spacing after backing off
+    :param target_latency: response time above which requests are slowed down
+    :param backoff: interval multiplier on errors
+    :param step: seconds added on errors, so a zero interval backs off too
+    :param recover: interval multiplier on fast answers
+    :param probe: floor multiplier on fast answers
+    """
+
+    def __init__(self, min_interval=1.0, max_interval=60.0, target_latency=2.0,
+                 backoff=2.0, step=0.25, recover=0.8, probe=0.99, clock=time.time, sleep=time.sleep):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.step = step
+        self.recover = recover
+        self.probe = probe
+        self.clock = clock
+        self.sleep = sleep
+        self.interval = min_interval
+        self.floor = min_interval
+        self.waited = 0.0
+        self._next = 0.0
+        self._backed_off = float("-inf")
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        block until the next request may start
+        :return: seconds waited
+        """
+        with self._lock:
+            now = self.clock()
+            start = max(now, self._next)
+            self._next = start + self.interval
+            self.waited += start - now
+        if start > now:
+            self.sleep(start - now)
+        return start - now
+
+    def record(self, elapsed, status, delay=None, started=None):
+        """
+        adapt the interval to one answer
+        :param elapsed: seconds the request took
+        :param status: http status, None for a connection error
+        :param delay: Retry-After of the answer in seconds
+        :param started: clock() before the request waited for its slot. errors
+            of requests queued before the last backoff belong to the same burst
+            and do not back off again
+        """
+        with self._lock:
+            if status in RETRY_STATUS:
+                if delay:
+                    self._next = max(self._next, self.clock() + delay)
+                if started is not None and started < self._backed_off:
+                    return
+                self.floor = min(max(self.floor, self.interval) * 1.25, self.max_interval)
+                self.interval = min(self.interval * self.backoff + self.step, self.max_interval)
+                self._backed_off = self.clock()
+            elif elapsed > self.target_latency:
+                self.interval = min(self.interval + self.step, self.max_interval)
+            else:
+                self.floor = max(self.floor * self.probe, self.min_interval)
+                self.interval = max(self.interval * self.recover, self.floor)
+
+
+def normalize_url(url, params=None):
+    """
+    url with lower-case scheme and host and the query params sorted,
+    params merged in and None params left out like requests does
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query += [(str(key), str(value)) for key, value in (params or {}).items() if value is not None]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/",
+                       urlencode(sorted(query)), ""))
+
+
+def open_cache(path=HTTP_CACHE, size=1024):
+    """ResponseCache of at most `size` MB, None if path is empty"""
+    if not path:
+        return None
+    return ResponseCache(path, max_bytes=size * 2 ** 20)
+
+
+class ResponseCache:
+    """
+    On-disk cache of response bodies addressed by the sha1 of the normalized url.
+
+    Each entry is one file, a json header line with the url and the time it
+    was stored followed by the zlib compressed body. A hit touches the file,
+    so the modification times order the entries by last use and the least
+    recently used ones are removed once the cache outgrows `max_bytes`.
+    Files are replaced atomically, processes may share the directory.
+
+    <path>/<sha1[:2]>/<sha1>
+    :param path: cache directory
+    :param max_bytes: size the cache is trimmed to 90% of when exceeded
+    """
+
+    def __init__(self, path=HTTP_CACHE, max_bytes=2 ** 30, clock=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _file(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return pjoin(self.path, key[:2], key)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if ".tmp" not in name:
+                    yield pjoin(root, name)
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(os.path.getsize(path) for path in self._entries())
+            return self._size
+
+    def get(self, url, ttl=None):
+        """
+        :param url: normalized url, see normalize_url
+        :param ttl: seconds an entry stays valid, None for ever
+        :return: body, None on a miss or an expired entry
+        """
+        path = self._file(url)
+        try:
+            with open(path, "rb") as fin:
+                header = json.loads(fin.readline().decode("utf-8"))
+                if ttl is not None and self.clock() - header["stored"] > ttl:
+                    self.misses += 1
+                    return None
+                body = zlib.decompress(fin.read())
+            os.utime(path)
+        except (OSError, ValueError, KeyError, zlib.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return body
+
+    def put(self, url, body):
+        path = self._file(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "{}.tmp{}-{}".format(path, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as fout:
+            fout.write(json.dumps({"url": url, "stored": self.clock()}).encode("utf-8") + b"\n")
+            fout.write(zlib.compress(body))
+        written = os.path.getsize(tmp)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp, path)
+        if self.size() + written - replaced > self.max_bytes:
+            self.evict()
+        else:
+            with self._lock:
+                self._size += written - replaced
+
+    def evict(self):
+        """remove the least recently used entries down to 90% of max_bytes"""
+        with self._lock:
+            entries = []
+            for path in self._entries():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+            size = sum(size for _, size, _ in entries)
+            for _, entry_size, path in entries:
+                if size <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= entry_size
+            self._size = size
+
+
+class Fetcher:
+    """
+    GET through a pooled session paced by an AdaptiveThrottle.
+
+    429/5xx answers and connection errors are retried up to `retries` times.
+    Every attempt is kept in `timings` as (url, status, elapsed), with status
+    None for connection errors. Safe to share between threads.
+    :param throttle: AdaptiveThrottle shared by every request
+    :param pool_size: connections kept alive, at least the number of threads
+    :param timeout: seconds before a request is given up
+    :param cache: ResponseCache read through before any request, None for none
+    """
+
+    def __init__(self, throttle=None, pool_size=4, retries=3, timeout=30.0, cache=None):
+        self.logger = get_logger()
+        self.throttle = throttle or AdaptiveThrottle()
+        self.session = open_session(pool_size)
+        self.retries = retries
+        self.timeout = timeout
+        self.cache = cache
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def _request(self, url, params):
+        start = time.time()
+        try:
+            r = self.session.get(url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.logger.debug("GET {} failed: {}".format(url, e))
+            return None, None, time.time() - start
+        return r, r.status_code, time.time() - start
+
+    def get(self, url, params=None, ttl=None):
+        """
+        :param ttl: seconds a cached answer stays valid, None for pages that never change
+        :return: body of a 200 answer, None once retries ran out or on other statuses
+        """
+        if self.cache is not None:
+            key = normalize_url(url, params)
+            content = self.cache.get(key, ttl)
+            if content is not None:
+                return content
+        content = self._get(url, params)
+        if content is not None and self.cache is not None:
+            self.cache.put(key, content)
+        return content
+
+    def _get(self, url, params):
+        for _ in range(self.retries + 1):
+            started = self.throttle.clock()
+            self.throttle.wait()
+            r, status, elapsed = self._request(url, params)
+            self.throttle.record(elapsed, status, retry_after(r) if r is not None else None, started)
+            with self._lock:
+                self.timings.append((url, status, elapsed))
+            if r is not None:
+                self.logger.debug("GET {} {} {:.3f}s".format(r.url, status, elapsed))
+            if status == 200:
+                return r.content
+            if status not in RETRY_STATUS:
+                break
+        self.logger.warning("GET error: {} {} {}".format(url, params or "", status))
+        return None
+
+    def stats(self):
+        """request count, failed attempts and latency percentiles in seconds"""
+        with self._lock:
+            timings = list(self.timings)
+        elapsed = sorted(elapsed for _, _, elapsed in timings)
+        hits = self.cache.hits if self.cache is not None else 0
+        if not elapsed:
+            return {"requests": 0, "errors": 0, "hits": hits}
+        return {
+            "requests": len(timings),
+            "hits": hits,
+            "errors": sum(1 for _, status, _ in timings if status != 200),
+            "mean": sum(elapsed) / len(elapsed),
+            "p50": elapsed[len(elapsed) // 2],
+            "p95": elapsed[min(int(len(elapsed) * 0.95), len(elapsed) - 1)],
+            "max": elapsed[-1],
+            "interval": self.throttle.interval,
+            "floor": self.throttle.floor,
+            "waited": self.throttle.waited,
+        }